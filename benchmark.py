@@ -0,0 +1,790 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 Apoorv Parle
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+# Offline benchmarks for conservativeContainerUpdate.py. A local stand-in server plays
+# GitHub (releases REST and GraphQL API, release assets, discussions pages) and a container registry
+# (token endpoint, manifest HEAD) with configurable latency and bandwidth, so runs
+# are repeatable and never touch github.com or ghcr.io. A second stand-in on a unix
+# socket plays the Docker/Podman engine API (image inspect and pull, containers).
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import http.server
+import urllib.parse
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import conservativeContainerUpdate as ccu
+
+####################################################################################
+
+# Synthetic release history for a number of apps. Version i of an app is v1.<i>.0;
+# every 10 versions (at i % 10 == 5) the compose file gains an environment variable
+# and a breaking-change announcement is published, everything else is an image bump.
+# Like immich's hwaccel files, service0 extends a service of a second file, and a
+# third file is included.
+class FixtureSet:
+    label = 'changelog:breaking-change'
+
+    def __init__(self, numApps: int = 8, numVersions: int = 40, numServices: int = 4):
+        self.numVersions = numVersions
+        self.numServices = numServices
+        self.repos = [('bench', f'app{i}') for i in range(numApps)]
+        # The immich changelog source is benchmarked against the same history.
+        self.repos.append(('immich-app', 'immich'))
+        self.now = datetime.now(timezone.utc)
+
+    def version(self, i: int) -> str:
+        return f"v1.{i}.0"
+
+    def versionIndex(self, version: str) -> int:
+        return int(version.split('.')[1])
+
+    def publishedAt(self, i: int) -> str:
+        return (self.now - timedelta(days=2 * (self.numVersions - i))).isoformat()
+
+    def isBreaking(self, i: int) -> bool:
+        return i % 10 == 5
+
+    def composeFile(self, repo: str, version: str) -> str:
+        i = self.versionIndex(version)
+        lines = ["name: " + repo, "services:"]
+        for s in range(self.numServices):
+            lines += [
+                f"  service{s}:",
+                f"    container_name: {repo}_service{s}",
+                *(["    extends:", "      file: hwaccel.yml", "      service: cpu"] if s == 0 else []),
+                f"    image: ghcr.io/bench/{repo}-service{s}:${{APP_VERSION:-release}}" if s < 2 else
+                f"    image: docker.io/library/dependency{s}:{i // 3}.0@sha256:{'%064x' % (i * 7919 + s)}",
+                "    restart: always",
+                "    environment:",
+                "      TZ: UTC",
+            ]
+            lines += [f"      SETTING_{k}: value{k}" for k in range((i + 5) // 10)]
+            lines += [
+                "    volumes:",
+                f"      - ${{UPLOAD_LOCATION}}/service{s}:/data",
+                "    healthcheck:",
+                "      disable: false",
+            ]
+        lines += ["volumes:", "  model-cache:", "include:", "  - extra.yml"]
+        return "\n".join(lines) + "\n"
+
+    def extraComposeFile(self, repo: str, fileName: str, version: str) -> str:
+        if fileName == 'hwaccel.yml':
+            return "services:\n  cpu:\n    devices:\n      - /dev/dri:/dev/dri\n"
+        if fileName == 'extra.yml':
+            return (f"services:\n  sidecar:\n    image: ghcr.io/bench/{repo}-sidecar:${{APP_VERSION:-release}}\n"
+                    f"    restart: always\nvolumes:\n  sidecar-data:\n")
+        return None
+
+    def latestRelease(self) -> dict:
+        i = self.numVersions - 1
+        return {'tag_name': self.version(i), 'published_at': self.publishedAt(i)}
+
+    def releases(self) -> list:
+        return [{'tag_name': self.version(i), 'published_at': self.publishedAt(i), 'draft': False, 'prerelease': False}
+                for i in reversed(range(self.numVersions))]
+
+    def manifest(self, repository: str, reference: str) -> bytes:
+        return json.dumps({'schemaVersion': 2, 'mediaType': 'application/vnd.oci.image.index.v1+json',
+                           'annotations': {'repository': repository, 'reference': reference}}).encode()
+
+    def imageDigest(self, repository: str, reference: str) -> str:
+        return 'sha256:' + hashlib.sha256(self.manifest(repository, reference)).hexdigest()
+
+    def discussions(self, owner: str, repo: str) -> list:
+        # Newest first, like the discussions list sorted by creation date.
+        return [{'number': 1000 + i, 'title': f"{self.version(i)} - breaking changes", 'url': f"/{owner}/{repo}/discussions/{1000 + i}"}
+                for i in reversed(range(self.numVersions)) if self.isBreaking(i)]
+
+####################################################################################
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    discussionsPerPage = 2
+    registryToken = 'bench-registry-token'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b'', contentType: str = 'application/json', headers: dict = None):
+        server = self.server
+        time.sleep(server.latency)
+        etag = '"%x"' % (hash(body) & 0xffffffff)
+        if body and self.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(body)))
+        if status in (200, 304):
+            self.send_header('ETag', etag)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        chunkSize = 16 * 1024
+        if self.command == 'HEAD':
+            body = b''
+        for start in range(0, len(body), chunkSize):
+            chunk = body[start:start + chunkSize]
+            if server.bandwidth:
+                time.sleep(len(chunk) / server.bandwidth)
+            self.wfile.write(chunk)
+        with server.lock:
+            server.requestCount += 1
+            server.bytesSent += len(body)
+
+    def do_GET(self):
+        fixtures = self.server.fixtures
+        url = urllib.parse.urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        query = urllib.parse.parse_qs(url.query)
+        rateLimit = {'X-RateLimit-Limit': '5000', 'X-RateLimit-Remaining': '4999',
+                     'X-RateLimit-Reset': str(int(time.time()) + 3600)}
+
+        if parts[:1] == ['v2'] and len(parts) >= 5 and parts[-2] == 'manifests':
+            # Registry API, anonymous bearer token flow like ghcr.io.
+            if self.headers.get('Authorization') != f"Bearer {self.registryToken}":
+                challenge = f'Bearer realm="{self.server.url}/token",service="bench",scope="repository:{"/".join(parts[1:-2])}:pull"'
+                self._send(401, b'{"errors": [{"code": "UNAUTHORIZED"}]}', headers={'WWW-Authenticate': challenge})
+            else:
+                repository, reference = "/".join(parts[1:-2]), parts[-1]
+                self._send(200, fixtures.manifest(repository, reference), contentType='application/vnd.oci.image.index.v1+json',
+                           headers={'Docker-Content-Digest': fixtures.imageDigest(repository, reference)})
+        elif parts == ['token']:
+            self._send(200, json.dumps({'token': self.registryToken, 'expires_in': 300}).encode())
+        elif parts[:1] == ['repos'] and parts[3:] == ['releases', 'latest']:
+            self._send(200, json.dumps(fixtures.latestRelease()).encode(), headers=rateLimit)
+        elif parts[:1] == ['repos'] and parts[3:] == ['releases']:
+            perPage = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            releases = fixtures.releases()[(page - 1) * perPage:page * perPage]
+            self._send(200, json.dumps(releases).encode(), headers=rateLimit)
+        elif len(parts) == 6 and parts[2:4] == ['releases', 'download'] and parts[5] == 'docker-compose.yml':
+            self._send(200, fixtures.composeFile(parts[1], parts[4]).encode(), contentType='text/yaml')
+        elif len(parts) == 6 and parts[2:4] == ['releases', 'download'] and fixtures.extraComposeFile(parts[1], parts[5], parts[4]):
+            self._send(200, fixtures.extraComposeFile(parts[1], parts[5], parts[4]).encode(), contentType='text/yaml')
+        elif len(parts) == 3 and parts[2] == 'discussions':
+            page = int(query.get('page', ['1'])[0])
+            items = fixtures.discussions(parts[0], parts[1])
+            items = items[(page - 1) * self.discussionsPerPage:page * self.discussionsPerPage]
+            html = "<html><body>" + "".join(
+                f'<div><a data-hovercard-type="discussion" href="{d["url"]}">{d["title"]}</a></div>' for d in items
+            ) + "</body></html>"
+            self._send(200, html.encode(), contentType='text/html')
+        else:
+            self._send(404, b'{"message": "Not Found"}')
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        fixtures = self.server.fixtures
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        variables = body.get('variables') or {}
+        if self.path != '/graphql' or not self.headers.get('Authorization'):
+            self._send(401 if self.path == '/graphql' else 404, b'{"message": "Requires authentication"}')
+        elif 'latestRelease' in body.get('query', ''):
+            # The release catalog query, one aliased repository field per o<i>/n<i> variable pair.
+            releases = [{'tagName': r['tag_name'], 'publishedAt': r['published_at'], 'isDraft': False, 'isPrerelease': False}
+                        for r in fixtures.releases()[:ccu.ReleaseCatalog.recentReleases]]
+            data = {}
+            for i in range(len(variables) // 2):
+                known = (variables[f"o{i}"], variables[f"n{i}"]) in fixtures.repos
+                data[f"r{i}"] = {'latestRelease': releases[0], 'releases': {'nodes': releases}} if known else None
+            self._send(200, json.dumps({'data': data}).encode())
+        else:
+            # Discussion search of the changelog sources, "repo:<owner>/<repo> ..." pages of 50.
+            owner, repo = variables['q'].split()[0][len('repo:'):].split('/')
+            start = int(variables.get('after') or 0)
+            items = fixtures.discussions(owner, repo)
+            nodes = [{'number': d['number'], 'title': d['title'], 'url': d['url']} for d in items[start:start + 50]]
+            pageInfo = {'hasNextPage': start + 50 < len(items), 'endCursor': str(start + 50)}
+            self._send(200, json.dumps({'data': {'search': {'pageInfo': pageInfo, 'nodes': nodes}}}).encode())
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, fixtures: FixtureSet, latency: float = 0.0, bandwidth: float = 0.0):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.requestCount = 0
+        self.bytesSent = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class StandInEngineHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.0 so the streamed pull ends when the connection closes, like the engine's chunked stream.
+    protocol_version = 'HTTP/1.0'
+    pullLayers = 3
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlparse(self.path)
+        path = urllib.parse.unquote(url.path)
+        query = urllib.parse.parse_qs(url.query)
+        if path.startswith('/images/') and path.endswith('/json'):
+            image = path[len('/images/'):-len('/json')]
+            with server.lock:
+                digest = server.images.get(image)
+            if digest is None:
+                self._json(404, {'message': f"No such image: {image}"})
+            else:
+                self._json(200, {'Id': digest, 'RepoDigests': [f"{image.rsplit(':', 1)[0]}@{digest}"]})
+        elif path == '/containers/json':
+            labels = json.loads(query.get('filters', ['{}'])[0]).get('label', [])
+            with server.lock:
+                containers = [c for c in server.containers.values() if all(k in c['Labels'] for k in labels)]
+            self._json(200, [{'Id': c['Id'], 'Labels': c['Labels']} for c in containers])
+        elif path.startswith('/containers/') and path.endswith('/json'):
+            with server.lock:
+                container = server.containers.get(path.split('/')[2])
+            self._json(200, container) if container else self._json(404, {'message': 'No such container'})
+        else:
+            self._json(404, {'message': 'page not found'})
+
+    def do_POST(self):
+        server = self.server
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path != '/images/create' or 'fromImage' not in query:
+            self._json(404, {'message': 'page not found'})
+            return
+        image = query['fromImage'][0]
+        registry, repository, tag, _ = ccu.parseImageReference(image)
+        if '/private-' in repository:
+            try:
+                auth = json.loads(base64.urlsafe_b64decode(self.headers.get('X-Registry-Auth', '')))
+            except ValueError:
+                auth = {}
+            if (auth.get('username'), auth.get('password')) != server.registryCredentials:
+                self._json(500, {'message': f"pull access denied for {repository}: unauthorized: authentication required"})
+                return
+        digest = server.fixtures.imageDigest(repository, tag)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        events = [{'status': f"Pulling from {repository}", 'id': tag}]
+        for layer in range(self.pullLayers):
+            events.append({'status': 'Downloading', 'id': f"layer{layer}", 'progressDetail': {'current': 512, 'total': 1024}})
+            events.append({'status': 'Pull complete', 'id': f"layer{layer}", 'progressDetail': {}})
+        events.append({'status': f"Digest: {digest}"})
+        for event in events:
+            self.wfile.write(json.dumps(event).encode() + b'\r\n')
+        with server.lock:
+            server.images[image] = digest
+            server.pullCount += 1
+
+class StandInEngineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, fixtures: FixtureSet, socketPath: str):
+        super().__init__(socketPath, StandInEngineHandler)
+        self.fixtures = fixtures
+        self.socketPath = socketPath
+        self.lock = threading.Lock()
+        self.images = {}
+        self.containers = {}
+        self.pullCount = 0
+        # Needed to pull the 'private-*' repositories.
+        self.registryCredentials = ('bench', 'bench-password')
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def addContainer(self, containerId: str, labels: dict, state: dict):
+        with self.lock:
+            self.containers[containerId] = {'Id': containerId, 'Name': '/' + containerId, 'Labels': labels,
+                                            'Config': {'Labels': labels}, 'State': state}
+
+# Stand-in docker/podman CLI answering the commands CliContainerEngine runs from the
+# stand-in engine, so the CLI fallback can be checked against the API backend.
+standInCliScript = '''#!/usr/bin/env python3
+import http.client, json, os, socket, sys, urllib.parse
+
+class Connection(http.client.HTTPConnection):
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(%r)
+
+def request(method, path, params=None):
+    connection = Connection('localhost')
+    # Credentials only the CLI knows, like a credential helper's.
+    headers = {'X-Registry-Auth': os.environ['STAND_IN_CLI_REGISTRY_AUTH']} if 'STAND_IN_CLI_REGISTRY_AUTH' in os.environ else {}
+    connection.request(method, path + ('?' + urllib.parse.urlencode(params) if params else ''), headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    if response.status >= 400:
+        sys.exit("Error: " + json.loads(body)['message'])
+    return body
+
+args = sys.argv[1:]
+if args[:2] == ['image', 'inspect']:
+    print(json.dumps(json.loads(request('GET', '/images/%%s/json' %% urllib.parse.quote(args[-1], safe='/:@')))['RepoDigests']))
+elif args[0] == 'pull':
+    request('POST', '/images/create', {'fromImage': args[-1]})
+elif args[0] == 'ps':
+    labelKey = args[args.index('--filter') + 1].partition('=')[2]
+    for container in json.loads(request('GET', '/containers/json', {'all': 'true', 'filters': json.dumps({'label': [labelKey]})})):
+        print(container['Id'], container['Labels'][labelKey])
+elif args[0] == 'inspect':
+    print(json.dumps([json.loads(request('GET', '/containers/%%s/json' %% args[1]))]))
+else:
+    sys.exit("Error: unsupported command " + " ".join(args))
+'''
+
+####################################################################################
+
+class Benchmark:
+    def __init__(self, fixtures: FixtureSet, server: StandInServer, workDir: str):
+        self.fixtures = fixtures
+        self.server = server
+        self.workDir = workDir
+        self.apps = []
+        self.engineServer = StandInEngineServer(fixtures, os.path.join(workDir, 'engine.sock')).start()
+        self.pointScriptAtServer()
+
+    def pointScriptAtServer(self):
+        ccu.GITHUB_URL = self.server.url
+        ccu.GITHUB_API_URL = self.server.url
+        ccu.registryEndpoints.update({'ghcr.io': self.server.url, 'docker.io': self.server.url})
+        ccu.notifier = None
+        for cli in ('docker', 'podman'):
+            ccu._containerEngines[(cli, False)] = ccu.ApiContainerEngine(self.engineServer.socketPath, cli)
+        for owner, repo in self.fixtures.repos:
+            if owner == 'immich-app':
+                continue
+            source = ccu.GitHubDiscussionsChangelogSource(owner, repo, FixtureSet.label)
+            ccu.app_metadata[repo] = {
+                'templateUrl': f"{self.server.url}/{owner}/{repo}/releases/download/<VERSION>/docker-compose.yml",
+                'owner': owner,
+                'repo': repo,
+                'tag2version': lambda s: s,
+                'validateVersion': lambda s: s.startswith('v'),
+                'versionEnvVariable': 'APP_VERSION',
+                'changelogSource': source,
+                'changelogBreakingChanges': lambda b, n, source=source: ccu.ChangelogBreakingChanges(source, b, n),
+                'allowRules': [],
+                'composeCompanionFiles': ['hwaccel.yml'],
+            }
+            self.apps.append(repo)
+
+    def freshCache(self, warm: bool):
+        # Cold runs start from an empty cache and changelog index every iteration.
+        if warm and ccu.httpCache.cacheDir:
+            return
+        cacheDir = tempfile.mkdtemp(dir=self.workDir)
+        ccu.httpCache = ccu.HttpCache(cacheDir)
+        ccu._changelogIndexes.clear()
+        ccu._composeFileMemo.clear()
+        ccu._fingerprintStore = None
+
+    def envFile(self, app: str, numLines: int = 0) -> str:
+        path = os.path.join(self.workDir, f"{app}.env")
+        baseVersion = self.fixtures.version(self.fixtures.numVersions - 2)
+        with open(path, 'w') as f:
+            f.write(f"APP_VERSION={baseVersion}\n")
+            f.write(f"UPLOAD_LOCATION=/srv/{app}\n")
+            for s in range(2, self.fixtures.numServices):
+                f.write(f"{app.upper()}_SERVICE{s}_IMAGE=docker.io/library/dependency{s}:1.0\n")
+            for k in range(numLines):
+                f.write(f"# filler line {k}\nFILLER_{k}=value{k}\n")
+        return path
+
+    def entryArgs(self, app: str):
+        args = ccu.buildArgParser().parse_args(['-a', 'immich', '-d', '-f', self.envFile(app)])
+        args.app = app
+        return args
+
+    # Each case returns a callable running one operation (and how many items it covers).
+
+    def case_readEnvFile(self, warm: bool):
+        path = self.envFile(self.apps[0], numLines=200)
+        return lambda: ccu.readEnvFile(path, self.apps[0]), 1
+
+    def case_updateEnvFile(self, warm: bool):
+        path = self.envFile(self.apps[0], numLines=200)
+        version, lines = ccu.readEnvFile(path, self.apps[0])
+        return lambda: ccu.updateEnvFile(path, lines, {'APP_VERSION': version}), 1
+
+    def case_CompareDockerCompose(self, warm: bool):
+        # The compose check of a run, as EvaluateBreakingChanges does it.
+        app = self.apps[0]
+        allowRules = ccu.app_metadata[app]['allowRules']
+        n = self.fixtures.numVersions
+        def run():
+            self.freshCache(warm)
+            ccu.CompareDockerCompose(app, self.fixtures.version(n - 2), self.fixtures.version(n - 1), allowRules)
+        return run, 1
+
+    def case_composeNextRelease(self, warm: bool):
+        # The usual run: the base release was the new release of the previous run and is
+        # in the HTTP cache (and with warm, still in the process), only the new one isn't.
+        app = self.apps[0]
+        allowRules = ccu.app_metadata[app]['allowRules']
+        self.freshCache(False)
+        position = [0]
+        def run():
+            i = position[0] % (self.fixtures.numVersions - 1)
+            position[0] += 1
+            if not warm:
+                ccu._composeFileMemo.clear()
+            ccu.CompareDockerCompose(app, self.fixtures.version(i), self.fixtures.version(i + 1), allowRules)
+        return run, 1
+
+    def case_immich_changelogBreakingChanges(self, warm: bool):
+        n = self.fixtures.numVersions
+        def run():
+            self.freshCache(warm)
+            ccu.immich_changelogBreakingChanges(self.fixtures.version(n - 2), self.fixtures.version(n - 1))
+        return run, 1
+
+    def case_e2e(self, warm: bool):
+        app = self.apps[0]
+        def run():
+            self.freshCache(warm)
+            appRun = ccu.runAppIsolated(self.entryArgs(app))
+            assert appRun.exitCode == 0, f"{app}: {appRun.title}"
+        return run, 1
+
+    def case_e2eBatch(self, warm: bool):
+        manifestPath = os.path.join(self.workDir, 'manifest.yml')
+        with open(manifestPath, 'w') as f:
+            json.dump([{'app': app, 'file': self.envFile(app), 'dry_run': True} for app in self.apps], f)
+        args = ccu.buildArgParser().parse_args(['-b', manifestPath, '-j', str(len(self.apps))])
+        def run():
+            self.freshCache(warm)
+            assert ccu.runBatch(args) == 0
+        return run, len(self.apps)
+
+    def case_registryDigests(self, warm: bool):
+        version = self.fixtures.version(self.fixtures.numVersions - 1)
+        images = [f"ghcr.io/bench/{app}-service{s}:{version}" for app in self.apps for s in range(2)]
+        images += [f"dependency{s}:1.0" for s in range(2, self.fixtures.numServices)]
+        def run():
+            # A cold client has to go through the token flow for every repository first.
+            if not warm:
+                ccu.registryClient = ccu.RegistryClient()
+            digests = ccu.registryClient.resolveDigests(images)
+            registry, repository, tag, _ = ccu.parseImageReference(images[-1])
+            assert digests[images[-1]] == self.fixtures.imageDigest(repository, tag), digests
+        return run, len(images)
+
+    def case_enginePull(self, warm: bool):
+        # Pre-pulling every image through the engine socket. Cold pulls all of them, warm finds them present by digest.
+        version = self.fixtures.version(self.fixtures.numVersions - 1)
+        images = [f"ghcr.io/bench/{app}-service{s}:{version}" for app in self.apps for s in range(2)]
+        engine = ccu.getContainerEngine('podman')
+        def run():
+            if not warm:
+                with self.engineServer.lock:
+                    self.engineServer.images.clear()
+            assert ccu.prePullImages(engine, images)
+            assert all(engine.imageDigests(image) for image in images)
+        return run, len(images)
+
+    def appContainers(self, app: str) -> str:
+        # Compose containers of the app on the stand-in engine (a healthy service, a finished
+        # init container and a one-off), plus an unrelated container. Returns the compose file.
+        composeFile = os.path.join(self.workDir, app, 'docker-compose.yml')
+        labels = {'com.docker.compose.project.config_files': composeFile}
+        self.engineServer.addContainer(f"{app}-server", labels, {'Status': 'running', 'Health': {'Status': 'healthy'}})
+        self.engineServer.addContainer(f"{app}-init", labels, {'Status': 'exited', 'ExitCode': 0})
+        self.engineServer.addContainer(f"{app}-run", dict(labels, **{'com.docker.compose.oneoff': 'True'}), {'Status': 'exited', 'ExitCode': 1})
+        self.engineServer.addContainer(f"{app}-other", {'com.docker.compose.project.config_files': composeFile + '.other'},
+                                       {'Status': 'exited', 'ExitCode': 2})
+        return composeFile
+
+    def checkEngineBackends(self):
+        # The CLI fallback must see what the API backend sees, and --system / DOCKER_HOST /
+        # XDG_RUNTIME_DIR must pick the right socket.
+        app = self.apps[0]
+        self.appContainers(app)
+        binDir = os.path.join(self.workDir, 'bin')
+        os.makedirs(binDir, exist_ok=True)
+        for cli in ('docker', 'podman'):
+            path = os.path.join(binDir, cli)
+            with open(path, 'w') as f:
+                f.write(standInCliScript % self.engineServer.socketPath)
+            os.chmod(path, 0o755)
+        runDir = os.path.join(self.workDir, 'run')
+        os.makedirs(os.path.join(runDir, 'podman'), exist_ok=True)
+        podmanSocket = os.path.join(runDir, 'podman', 'podman.sock')
+        if not os.path.exists(podmanSocket):
+            os.symlink(self.engineServer.socketPath, podmanSocket)
+
+        savedEngines, savedUseEngineApi = dict(ccu._containerEngines), ccu.useEngineApi
+        savedEnv = {k: os.environ.get(k) for k in ('PATH', 'XDG_RUNTIME_DIR', 'DOCKER_HOST', 'DOCKER_CONFIG', 'REGISTRY_AUTH_FILE')}
+        try:
+            os.environ['PATH'] = binDir + os.pathsep + os.environ.get('PATH', '')
+            os.environ['XDG_RUNTIME_DIR'] = runDir
+            os.environ['DOCKER_HOST'] = 'unix://' + self.engineServer.socketPath
+            ccu._containerEngines.clear()
+            ccu.useEngineApi = True
+            assert ccu.engineSocketPath('podman', False) == podmanSocket
+            assert ccu.engineSocketPath('podman', True) == '/run/podman/podman.sock'
+            assert ccu.engineSocketPath('docker', True) == self.engineServer.socketPath
+            api = ccu.getContainerEngine('podman')
+            assert isinstance(api, ccu.ApiContainerEngine) and api.socketPath == podmanSocket, api.name
+            assert isinstance(ccu.getContainerEngine('docker', True), ccu.ApiContainerEngine)
+            if not os.path.exists('/run/podman/podman.sock'):
+                assert isinstance(ccu.getContainerEngine('podman', True), ccu.CliContainerEngine)
+            ccu._containerEngines.clear()
+            ccu.useEngineApi = False
+            cli = ccu.getContainerEngine('podman')
+            assert isinstance(cli, ccu.CliContainerEngine), cli.name
+
+            labelKey = 'com.docker.compose.project.config_files'
+            assert sorted(cli.containers(labelKey)) == sorted(api.containers(labelKey)) != []
+            assert cli.containers('PODMAN_SYSTEMD_UNIT') == api.containers('PODMAN_SYSTEMD_UNIT') == []
+            for containerId in (f"{app}-server", f"{app}-init"):
+                assert cli.inspectContainer(containerId) == api.inspectContainer(containerId)
+            for engine in (cli, api):
+                try:
+                    engine.inspectContainer('missing')
+                    assert False, f"{engine.name}: inspecting a missing container didn't fail"
+                except ccu.EngineError:
+                    pass
+            image = f"ghcr.io/bench/{app}-service0:{self.fixtures.version(0)}"
+            with self.engineServer.lock:
+                self.engineServer.images.pop(image, None)
+            assert cli.imageDigests(image) is None and api.imageDigests(image) is None
+            cli.pull(image)
+            registry, repository, tag, _ = ccu.parseImageReference(image)
+            assert cli.imageDigests(image) == api.imageDigests(image) == [self.fixtures.imageDigest(repository, tag)]
+
+            # Private images: the API pull sends the 'docker login' / 'podman login' credentials,
+            # and falls back to the CLI (and its credential helpers) when the engine denies it.
+            privateImage = f"ghcr.io/bench/private-{app}:{self.fixtures.version(0)}"
+            username, password = self.engineServer.registryCredentials
+            loginAuth = {'auths': {'ghcr.io': {'auth': base64.b64encode(f"{username}:{password}".encode()).decode()}}}
+            dockerConfig = os.path.join(self.workDir, 'docker-config')
+            os.makedirs(dockerConfig, exist_ok=True)
+            with open(os.path.join(dockerConfig, 'config.json'), 'w') as f:
+                json.dump(loginAuth, f)
+            with open(os.path.join(self.workDir, 'podman-auth.json'), 'w') as f:
+                json.dump(loginAuth, f)
+            dockerApi = ccu.ApiContainerEngine(self.engineServer.socketPath, 'docker')
+            for engine, variable, value in ((dockerApi, 'DOCKER_CONFIG', dockerConfig), (api, 'REGISTRY_AUTH_FILE', os.path.join(self.workDir, 'podman-auth.json'))):
+                with self.engineServer.lock:
+                    self.engineServer.images.pop(privateImage, None)
+                os.environ[variable] = value
+                engine.pull(privateImage)
+                assert engine.imageDigests(privateImage), f"{engine.name}: {privateImage}"
+            with self.engineServer.lock:
+                self.engineServer.images.pop(privateImage, None)
+            os.environ['DOCKER_CONFIG'] = os.path.join(self.workDir, 'no-docker-config')
+            try:
+                dockerApi.pull(privateImage)
+                assert False, "pulling a private image without credentials didn't fail"
+            except ccu.EngineError:
+                pass
+            os.environ['STAND_IN_CLI_REGISTRY_AUTH'] = base64.urlsafe_b64encode(json.dumps({'username': username, 'password': password}).encode()).decode()
+            try:
+                dockerApi.pull(privateImage)
+            finally:
+                del os.environ['STAND_IN_CLI_REGISTRY_AUTH']
+            assert dockerApi.imageDigests(privateImage), privateImage
+        finally:
+            for k, v in savedEnv.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            ccu._containerEngines.clear()
+            ccu._containerEngines.update(savedEngines)
+            ccu.useEngineApi = savedUseEngineApi
+
+    def case_engineHealthCheck(self, warm: bool):
+        # Finding an app's compose containers and verifying them through the engine socket,
+        # as after a restart. Checks the CLI fallback and socket selection once beforehand.
+        self.checkEngineBackends()
+        composeFiles = [self.appContainers(app) for app in self.apps]
+        broken = os.path.join(self.workDir, 'broken', 'docker-compose.yml')
+        self.engineServer.addContainer('broken-server', {'com.docker.compose.project.config_files': broken}, {'Status': 'exited', 'ExitCode': 2})
+        engine = ccu.getContainerEngine('docker')
+        def run():
+            for app, composeFile in zip(self.apps, composeFiles):
+                containerIds = ccu.composeContainers(composeFile)
+                assert sorted(containerIds) == sorted(f"{app}-{name}" for name in ('server', 'init', 'run')), containerIds
+                healthy, _ = ccu.verifyHealth(engine, containerIds, [], 5)
+                assert healthy, app
+            assert not ccu.verifyHealth(engine, ccu.composeContainers(broken), [], 5)[0]
+            assert not ccu.verifyHealth(engine, ccu.composeContainers(broken + '.missing'), [], 5)[0]
+        return run, len(self.apps)
+
+    def case_releaseResolution(self, warm: bool):
+        # Resolving 'latest' for every app, batched through GraphQL (a token is set).
+        def run():
+            self.freshCache(warm)
+            if not warm:
+                ccu.releaseCatalog = ccu.ReleaseCatalog()
+            ccu.githubToken = 'bench-token'
+            try:
+                for app in self.apps:
+                    tag, _ = ccu.GetLatestGitHubReleaseTag('bench', app)
+                    assert tag == self.fixtures.latestRelease()['tag_name'], tag
+            finally:
+                ccu.githubToken = None
+        return run, len(self.apps)
+
+    def case_startup(self, warm: bool):
+        # A no-op run of the launcher the systemd units run, the one --check-startup compares with this baseline.
+        scriptDir = os.path.dirname(os.path.abspath(ccu.__file__))
+        command = ccu.noOpCommand(os.path.join(scriptDir, 'conservativeContainerUpdate'), tempfile.mkdtemp(dir=self.workDir))
+        return lambda: subprocess.run(command, cwd=scriptDir, check=True, stdout=subprocess.DEVNULL), 1
+
+    cases = ['readEnvFile', 'updateEnvFile', 'CompareDockerCompose', 'composeNextRelease', 'immich_changelogBreakingChanges', 'registryDigests',
+             'enginePull', 'engineHealthCheck', 'releaseResolution', 'e2e', 'e2eBatch', 'startup']
+
+    def measure(self, caseName: str, warm: bool, iterations: int, warmup: int) -> dict:
+        operation, itemsPerOp = getattr(self, 'case_' + caseName)(warm)
+        samples = []
+        requestsBefore, bytesBefore = self.server.requestCount, self.server.bytesSent
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(warmup + iterations):
+                if i == warmup:
+                    requestsBefore, bytesBefore = self.server.requestCount, self.server.bytesSent
+                ccu._defaultRun.events.clear()
+                start = time.perf_counter()
+                operation()
+                if i >= warmup:
+                    samples.append(time.perf_counter() - start)
+        return summarize(samples, itemsPerOp, (self.server.requestCount - requestsBefore) / iterations,
+                         (self.server.bytesSent - bytesBefore) / iterations)
+
+####################################################################################
+
+def percentile(sortedSamples: list, p: float) -> float:
+    k = (len(sortedSamples) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(sortedSamples) - 1)
+    return sortedSamples[lo] + (sortedSamples[hi] - sortedSamples[lo]) * (k - lo)
+
+def summarize(samples: list, itemsPerOp: int, requestsPerOp: float, bytesPerOp: float) -> dict:
+    s = sorted(samples)
+    return {
+        'iterations': len(s),
+        'p50_ms': percentile(s, 50) * 1000,
+        'p90_ms': percentile(s, 90) * 1000,
+        'p99_ms': percentile(s, 99) * 1000,
+        'mean_ms': statistics.fmean(s) * 1000,
+        'throughput_per_s': itemsPerOp * len(s) / sum(s),
+        'requests_per_op': requestsPerOp,
+        'bytes_per_op': bytesPerOp,
+    }
+
+def printResults(results: dict, baseline: dict, tolerance: float) -> int:
+    regressions = 0
+    print(f"{'benchmark':<44} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'ops/s':>9} {'req/op':>7}  vs baseline p50")
+    for name, r in results.items():
+        line = f"{name:<44} {r['p50_ms']:9.2f} {r['p90_ms']:9.2f} {r['p99_ms']:9.2f} {r['throughput_per_s']:9.1f} {r['requests_per_op']:7.1f}"
+        base = baseline.get('results', {}).get(name) if baseline else None
+        if base:
+            change = r['p50_ms'] / base['p50_ms'] - 1 if base['p50_ms'] else 0.0
+            regressed = change > tolerance
+            regressions += regressed
+            line += f"  {change:+7.1%}{'  REGRESSION' if regressed else ''}"
+        print(line)
+    return regressions
+
+####################################################################################
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of conservativeContainerUpdate.py against a local GitHub stand-in server.",
+        formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument('-c', "--case", action='append', choices=Benchmark.cases,
+                        help="Benchmark to run, can be repeated (default: all)")
+    parser.add_argument('-n', "--iterations", default=20, type=int, help="Measured iterations per benchmark")
+    parser.add_argument('-w', "--warmup", default=2, type=int, help="Unmeasured warm-up iterations per benchmark")
+    parser.add_argument("--apps", default=8, type=int, help="Number of synthetic apps")
+    parser.add_argument("--versions", default=40, type=int, help="Number of releases per synthetic app")
+    parser.add_argument("--latency-ms", default=20.0, type=float, help="Added latency per request of the stand-in server")
+    parser.add_argument("--bandwidth-kbps", default=0.0, type=float, help="Bandwidth of the stand-in server in KiB/s (0: unlimited)")
+    parser.add_argument("--cache", choices=['cold', 'warm', 'both'], default='both', help="Run with an empty or a primed HTTP cache")
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json'),
+                        help="Baseline results to compare against (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", default=0.25, type=float, help="Allowed p50 slowdown against the baseline before failing")
+    parser.add_argument("--json", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    fixtures = FixtureSet(args.apps, args.versions)
+    server = StandInServer(fixtures, args.latency_ms / 1000, args.bandwidth_kbps * 1024).start()
+    workDir = tempfile.mkdtemp(prefix='ccu-bench-')
+    results = {}
+    bench = None
+    try:
+        bench = Benchmark(fixtures, server, workDir)
+        modes = {'cold': [False], 'warm': [True], 'both': [False, True]}[args.cache]
+        for caseName in args.case or Benchmark.cases:
+            for warm in modes:
+                name = f"{caseName}[{'warm' if warm else 'cold'}]"
+                print(f"Running {name} ...", file=sys.stderr)
+                results[name] = bench.measure(caseName, warm, args.iterations, args.warmup)
+    finally:
+        server.shutdown()
+        if bench:
+            bench.engineServer.shutdown()
+        shutil.rmtree(workDir, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    regressions = printResults(results, baseline, args.tolerance)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'settings': {k: v for k, v in vars(args).items() if k not in ('baseline', 'save_baseline', 'json')},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif baseline and baseline.get('settings') != report['settings']:
+        print("Note: baseline was recorded with different settings, comparison is only indicative.")
+    sys.exit(1 if regressions else 0)
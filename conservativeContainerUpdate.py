@@ -4,19 +4,43 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import requests
-import yaml
-import jsondiff
 import sys
 import argparse
 import os
 import re
+import json
+import time
+import bisect
+import fnmatch
+import shlex
+import copy
+import hashlib
+import random
+import email.utils
+import threading
+import signal
+import socket
+import http.client
+import http.server
+import urllib.parse
+import contextvars
+import contextlib
+import io
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta, timezone
 from typing import List
-from packaging.version import parse as parseVersionString
-import requests
-from bs4 import BeautifulSoup
+import requests.adapters
 import subprocess
 
+# yaml, bs4 and packaging are imported by the stage that needs them, so the
+# common "no update" runs don't pay for them (see --check-startup).
+lazyModules = ['yaml', 'bs4', 'packaging']
+
+def parseVersionString(s: str):
+    from packaging.version import parse
+    return parse(s)
+
 ####################################################################################
 class GotifyNotifier:
     def __init__(self, url: str, token: str):
@@ -31,27 +55,308 @@ class GotifyNotifier:
         }
 
         try:
-            response = requests.post(self.url, data=payload, params={"token": self.token})
+            # Notifications go out even after the run deadline or a cancelled check, they report the verdict.
+            response = httpClient.post(self.url, bounded=False, data=payload, params={"token": self.token})
             response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
             print(f"Gotify notification sent successfully!")
+            return True
         except requests.exceptions.RequestException as e:
             print(f"Error sending Gotify notification: {e}")
         except Exception as e:
             print(f"An unexpected error occurred while sending Gotify notification: {e}")
+        return False
+
+def truncateMessage(message: str, maxChars: int) -> str:
+    # Keeps the start (what changed) and the end (the verdict) of an oversized log.
+    if len(message) <= maxChars:
+        return message
+    head, tail = message[:maxChars * 2 // 3], message[-(maxChars // 3):]
+    omitted = message[len(head):len(message) - len(tail)]
+    return f"{head}\n… {omitted.count(chr(10))} lines ({len(omitted)} characters) omitted …\n{tail}"
+
+# Sends notifications from a background thread so the pipeline doesn't wait for
+# Gotify. In digest mode (batch and daemon) the notifications of one run are held
+# until flush() and sent as a single message. Undelivered notifications are kept in a
+# small JSON file and retried with exponential backoff, later in this process or by
+# the next run. Processes can share the file (e.g. the daemon and a manual run): each
+# item is owned by the process that sends it, and the file is merged under a lock.
+# Items of a process that has exited are taken over by the next one to save.
+class NotificationQueue:
+    maxMessageChars = 32000
+    maxEntryChars = 8000
+    maxQueued = 20
+    retryBase = 60
+    retryMax = 6 * 3600
+    maxAge = timedelta(days=7)
+
+    def __init__(self, transport, path: str = None, digest: bool = False):
+        self.transport = transport
+        self.path = path
+        self.digest = digest
+        self.condition = threading.Condition()
+        self.held = []
+        self.pending = []
+        # The item being sent; kept out of the items themselves, they are saved as they are.
+        self.sending = None
+        self.closed = False
+        if self.path and os.path.exists(self.path):
+            self._save()
+            if self.pending:
+                print(f"== {len(self.pending)} undelivered notification(s) queued from earlier runs")
+        self.worker = threading.Thread(target=self._work, name='notifications', daemon=True)
+        self.worker.start()
+
+    def send(self, title: str, message: str):
+        message = truncateMessage(message, self.maxEntryChars if self.digest else self.maxMessageChars)
+        with self.condition:
+            if self.digest:
+                self.held.append((title, message))
+            else:
+                self._enqueue(title, message)
+
+    def flush(self):
+        # Sends the held notifications as one digest.
+        with self.condition:
+            held, self.held = self.held, []
+            if len(held) == 1:
+                self._enqueue(*held[0])
+            elif held:
+                title = f"Conservative update: {len(held)} apps, " + ", ".join(sorted({t for t, _ in held}))
+                message = "\n".join(f"{t}\n{m}" for t, m in held)
+                self._enqueue(title[:250], truncateMessage(message, self.maxMessageChars))
+
+    def _enqueue(self, title: str, message: str):
+        self.pending.append({'id': os.urandom(16).hex(), 'owner': os.getpid(), 'title': title, 'message': message,
+                             'created': time.time(), 'attempts': 0, 'nextAttempt': 0})
+        if len(self.pending) > self.maxQueued:
+            print(f"== Notification queue is full, dropping the oldest of {len(self.pending)} notifications")
+            self.pending = self.pending[-self.maxQueued:]
+        self._save()
+        self.condition.notify_all()
+
+    @staticmethod
+    def _ownerAlive(pid) -> bool:
+        if pid == os.getpid():
+            return True
+        if not isinstance(pid, int):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    def _save(self):
+        # Writes this process's items next to the ones other running processes own.
+        if not self.path:
+            return
+        import fcntl
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(f"{self.path}.lock", 'a') as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+                try:
+                    with open(self.path, 'r') as f:
+                        stored = json.load(f)
+                except FileNotFoundError:
+                    stored = []
+                except ValueError as e:
+                    print(f"== Warning: Ignoring unreadable notification queue '{self.path}': {e}")
+                    stored = []
+                others = []
+                for item in stored:
+                    if item.get('owner') == os.getpid():
+                        continue
+                    if self._ownerAlive(item.get('owner')):
+                        others.append(item)
+                        continue
+                    # Left behind by a process that has exited.
+                    item.pop('sending', None)
+                    item.setdefault('id', os.urandom(16).hex())
+                    item['owner'] = os.getpid()
+                    self.pending.append(item)
+                tmpPath = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmpPath, 'w') as f:
+                    json.dump(others + self.pending, f, indent=1)
+                os.replace(tmpPath, self.path)
+        except IOError as e:
+            print(f"== Warning: Failed to save the notification queue '{self.path}': {e}")
+
+    def _due(self):
+        now = time.time()
+        self.pending = [item for item in self.pending if now - item['created'] < self.maxAge.total_seconds()]
+        due = [item for item in self.pending if item['nextAttempt'] <= now and item is not self.sending]
+        return due[0] if due else None
+
+    def _work(self):
+        while True:
+            with self.condition:
+                item = self._due()
+                while item is None and not self.closed:
+                    waitFor = min((i['nextAttempt'] for i in self.pending if i is not self.sending), default=time.time() + 60) - time.time()
+                    self.condition.wait(min(max(waitFor, 0.1), 60))
+                    item = self._due()
+                if item is None:
+                    return
+                self.sending = item
+            delivered = self.transport.send(item['title'], item['message'])
+            with self.condition:
+                self.sending = None
+                if delivered:
+                    self.pending = [i for i in self.pending if i is not item]
+                else:
+                    item['attempts'] += 1
+                    delay = min(self.retryMax, self.retryBase * 2 ** (item['attempts'] - 1))
+                    item['nextAttempt'] = time.time() + delay * random.uniform(0.5, 1)
+                    print(f"== Notification '{item['title']}' not delivered, retrying in {delay / 60:.0f} min or on the next run")
+                self._save()
+                self.condition.notify_all()
+
+    def close(self, timeout: float = 30):
+        # Sends what is due (held notifications included) and keeps the rest for the next run.
+        self.flush()
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.condition.notify_all()
+            while (self._due() is not None or self.sending is not None) and time.monotonic() < deadline:
+                self.condition.wait(min(1, max(deadline - time.monotonic(), 0.01)))
+            self.closed = True
+            self.condition.notify_all()
+            if self.pending:
+                print(f"== {len(self.pending)} notification(s) left in {self.path or 'memory'} for the next run")
+
+def flushNotifications():
+    if isinstance(notifier, NotificationQueue):
+        notifier.flush()
 
 notifier = None
 
 ####################################################################################
 
-globalLog = ""
+# Per-app state for one pipeline evaluation. Each app (or batch entry) gets its own
+# log, notifier and verdict so concurrently evaluated apps don't step on each other.
+class AppRun:
+    def __init__(self, app: str, notifier=None, logPrefix: str = "", previousTitle: str = None):
+        self.app = app
+        self.notifier = notifier
+        self.logPrefix = logPrefix
+        # Verdict of the previous evaluation of this app (daemon mode), an unchanged
+        # verdict isn't notified again.
+        self.previousTitle = previousTitle
+        self.title = None
+        self.exitCode = None
+        # When a blocked release becomes eligible, so the daemon can re-check right then.
+        self.nextCheckAt = None
+        # Structured record of the run: log messages and finished stage spans in order,
+        # plus run wide counters (HTTP bytes, cache hits, ...).
+        self.events = []
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+
+    @property
+    def log(self):
+        return "".join(event['message'] + "\n" for event in self.events if event['type'] == 'log')
+
+    def addCounter(self, name: str, value: float):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+_defaultRun = AppRun(None)
+_currentRun = contextvars.ContextVar('currentRun', default=_defaultRun)
+
+def currentRun() -> AppRun:
+    return _currentRun.get()
+
+def submitInRun(executor, fn, *args, **kwargs):
+    # Run fn on the pool inside a copy of the caller's context, so printAndLog and
+    # the notify helpers from worker threads land in the right AppRun.
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
+
 def printAndLog(s: str):
-    global globalLog
-    print(s)
-    globalLog = globalLog + s + "\n"
+    if isCancelled():
+        # A check still finishing after the verdict was decided; its output would only confuse the log.
+        return
+    run = currentRun()
+    print(run.logPrefix + s if run.logPrefix else s)
+    currentSpan = _currentSpan.get()
+    run.events.append({'type': 'log', 'time': time.time(), 'span': currentSpan.name if currentSpan else None, 'message': s})
+
+####################################################################################
+
+# A timed pipeline stage. Spans nest through a context variable (which submitInRun
+# carries over to worker threads) and collect counters such as bytes transferred.
+class Span:
+    def __init__(self, name: str, parent, attrs: dict):
+        self.name = name
+        self.parent = parent
+        self.attrs = attrs
+        self.counters = {}
+        self.startTime = time.time()
+        self.duration = None
+        self.error = None
+
+    def toEvent(self) -> dict:
+        return {'type': 'span', 'name': self.name, 'parent': self.parent.name if self.parent else None,
+                'start': self.startTime, 'duration': self.duration, 'error': self.error,
+                **self.attrs, **self.counters}
+
+_currentSpan = contextvars.ContextVar('currentSpan', default=None)
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    run = currentRun()
+    s = Span(name, _currentSpan.get(), attrs)
+    token = _currentSpan.set(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"exit {e.code}" if isinstance(e, SystemExit) else type(e).__name__
+        raise
+    finally:
+        s.duration = time.perf_counter() - start
+        _currentSpan.reset(token)
+        run.events.append(s.toEvent())
+
+def runInSpan(name: str, fn, *args, **kwargs):
+    with span(name):
+        return fn(*args, **kwargs)
+
+def recordCounter(name: str, value: float = 1):
+    run = currentRun()
+    with run.lock:
+        s = _currentSpan.get()
+        while s is not None:
+            s.counters[name] = s.counters.get(name, 0) + value
+            s = s.parent
+    run.addCounter(name, value)
+
+# Orders recording a verdict against cancelling the checks (EvaluateBreakingChanges).
+_finishLock = threading.Lock()
+
+def finishRun(title: str, e: int):
+    run = currentRun()
+    with _finishLock:
+        if isCancelled():
+            # A check cancelled after the verdict was decided; its exit (e.g. an error) has no say.
+            sys.exit(e)
+        if run.exitCode is not None:
+            # Verdict already reported, e.g. by a concurrent check of the same app.
+            sys.exit(run.exitCode)
+        run.title = title
+        run.exitCode = e
+    runNotifier = run.notifier if run.notifier is not None else notifier
+    if runNotifier is not None and title == run.previousTitle:
+        print(f"{run.logPrefix}== Verdict unchanged since the last check, not notifying again.")
+    elif runNotifier is not None: runNotifier.send(title, run.log)
+    sys.exit(e)
 
 def notifyErrorAndExit(e: int):
-    if notifier is not None: notifier.send("❌Error during conservative update", globalLog) 
-    exit(e)
+    finishRun("❌Error during conservative update", e)
 
 def myassert(c: bool, s: str):
     if not c:
@@ -59,127 +364,1227 @@ def myassert(c: bool, s: str):
         notifyErrorAndExit(10)
 
 def notifyAndExit(title: str):
-    if notifier is not None: notifier.send(title, globalLog)
-    exit(0)
+    finishRun(title, 0)
 
 ####################################################################################
 
-def restartDockerCompose(composeFile: str):
-    if not os.path.exists(composeFile):
-        printAndLog(f"== Error: File not found at '{composeFile}'")
-        notifyErrorAndExit(5)
+class DeadlineExceeded(requests.exceptions.RequestException):
+    pass
+
+class RequestCancelled(requests.exceptions.RequestException):
+    pass
+
+# Per-evaluation deadline (daemon mode), overrides the client's run deadline.
+_runDeadline = contextvars.ContextVar('runDeadline', default=None)
+
+# Set by EvaluateBreakingChanges for its concurrent checks; once set, their requests
+# raise RequestCancelled because the verdict is already decided.
+_cancelEvent = contextvars.ContextVar('cancelEvent', default=None)
+
+def isCancelled() -> bool:
+    event = _cancelEvent.get()
+    return event is not None and event.is_set()
+
+def raiseIfCancelled():
+    if isCancelled():
+        raise RequestCancelled("Check cancelled, the verdict is already decided")
+
+# Single HTTP client layer for the whole run: one pooled keep-alive Session, connect
+# and read timeouts on every request, retries of transient failures (connection
+# errors, 429, 5xx and GitHub's rate limit 403) with jittered exponential backoff
+# honoring Retry-After, and an overall deadline after which requests fail cleanly.
+# Requests made with bounded=False ignore the deadline and check cancellation.
+class HttpClient:
+    retryStatuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, connectTimeout: float = 5, readTimeout: float = 30, retries: int = 3,
+                 backoffBase: float = 0.5, backoffMax: float = 30, runTimeout: float = None, poolSize: int = 10):
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.retries = retries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.runTimeout = runTimeout
+        self.deadline = time.monotonic() + runTimeout if runTimeout else None
+        # Last rate limit reported by the GitHub API: remaining, limit and reset (epoch seconds).
+        self.rateLimit = None
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def remaining(self) -> float:
+        deadline = _runDeadline.get() or self.deadline
+        return float('inf') if deadline is None else deadline - time.monotonic()
+
+    def _trackRateLimit(self, response):
+        try:
+            if 'X-RateLimit-Remaining' in response.headers:
+                self.rateLimit = {
+                    'remaining': int(response.headers['X-RateLimit-Remaining']),
+                    'limit': int(response.headers.get('X-RateLimit-Limit', 0)),
+                    'reset': float(response.headers.get('X-RateLimit-Reset', 0)),
+                }
+        except ValueError:
+            pass
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoffMax, self.backoffBase * (2 ** attempt)))
+
+    @staticmethod
+    def _retryAfter(response) -> float:
+        retryAfter = response.headers.get('Retry-After')
+        if retryAfter:
+            try:
+                return max(0.0, float(retryAfter))
+            except ValueError:
+                try:
+                    return max(0.0, (email.utils.parsedate_to_datetime(retryAfter) - datetime.now(timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    return None
+        if response.headers.get('X-RateLimit-Remaining') == '0' and response.headers.get('X-RateLimit-Reset'):
+            return max(0.0, float(response.headers['X-RateLimit-Reset']) - time.time())
+        return None
+
+    def _isRetryable(self, response) -> bool:
+        if response.status_code in self.retryStatuses:
+            return True
+        return response.status_code == 403 and response.headers.get('X-RateLimit-Remaining') == '0'
+
+    def request(self, method: str, url: str, bounded: bool = True, **kwargs):
+        for attempt in range(self.retries + 1):
+            if bounded:
+                raiseIfCancelled()
+            remaining = self.remaining() if bounded else float('inf')
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Run deadline exceeded before {method} {url}")
+            timeout = (min(self.connectTimeout, remaining), min(self.readTimeout, remaining))
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                self._trackRateLimit(response)
+                recordCounter('httpRequests')
+                recordCounter('httpBytes', len(response.content))
+                if bounded:
+                    raiseIfCancelled()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self._backoff(attempt)
+                reason = str(e)
+            else:
+                if attempt == self.retries or not self._isRetryable(response):
+                    return response
+                delay = self._retryAfter(response)
+                if delay is None:
+                    delay = self._backoff(attempt)
+                reason = f"HTTP {response.status_code}"
+
+            if bounded and delay >= self.remaining():
+                raise DeadlineExceeded(f"Run deadline exceeded while retrying {method} {url} ({reason}, retry in {delay:.1f}s)")
+            print(f"== Retrying {method} {url} in {delay:.1f}s after {reason} (attempt {attempt + 1}/{self.retries})")
+            cancelEvent = _cancelEvent.get() if bounded else None
+            if cancelEvent is not None:
+                cancelEvent.wait(delay)
+            else:
+                time.sleep(delay)
 
-    workingDir = os.path.dirname(composeFile)
-    try:
-        printAndLog(f"Running docker compose down for file {composeFile} ...")
-        result = subprocess.run(['docker', 'compose', '-f', composeFile, 'down'], capture_output=True, text=True, check=True, cwd=workingDir)
-        printAndLog(f"docker compose down successfully. Output: {result.stdout.strip()}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to do docker compose down. Error: {e.stderr.strip()}")
-        notifyErrorAndExit(7)
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+# Replaced with the configured client in __main__.
+httpClient = HttpClient()
+
+####################################################################################
 
+# Writes each finished AppRun as JSON lines (all log and span events plus a run
+# summary) and as a node_exporter textfile with per-stage durations and counters.
+class MetricsExporter:
+    prefix = 'conservative_update_'
+    helpTexts = {
+        'run_duration_seconds': 'Wall time of the last run.',
+        'run_exit_code': 'Exit code of the last run.',
+        'last_run_timestamp_seconds': 'Start of the last run.',
+        'stage_duration_seconds': 'Time spent in each pipeline stage during the last run.',
+        'downtime_seconds': 'Time the app was down while its services were cycled in the last run.',
+        'time_to_healthy_seconds': 'Time from restart until all containers and probes were ready in the last run.',
+        'time_to_rollback_seconds': 'Time from restart until the rollback of an unhealthy update finished in the last run.',
+    }
+
+    def __init__(self, jsonlPath: str = None, textfilePath: str = None):
+        self.jsonlPath = jsonlPath
+        self.textfilePath = textfilePath
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def summary(run: AppRun) -> dict:
+        return {'type': 'run', 'app': run.app, 'start': run.startTime, 'duration': time.time() - run.startTime,
+                'exitCode': run.exitCode, 'verdict': run.title, **run.counters}
+
+    def export(self, run: AppRun):
+        with self.lock:
+            if self.jsonlPath:
+                with open(self.jsonlPath, 'a') as f:
+                    for event in run.events + [self.summary(run)]:
+                        f.write(json.dumps(dict(event, app=run.app), default=str) + "\n")
+            if self.textfilePath:
+                self._writeTextfile(run)
+
+    def _samples(self, run: AppRun) -> list:
+        summary = self.summary(run)
+        labels = f'app="{run.app}"'
+        stageDurations = {}
+        for event in run.events:
+            if event['type'] == 'span':
+                stageDurations[event['name']] = stageDurations.get(event['name'], 0) + event['duration']
+        samples = [
+            ('run_duration_seconds', labels, summary['duration']),
+            ('run_exit_code', labels, run.exitCode or 0),
+            ('last_run_timestamp_seconds', labels, run.startTime),
+        ]
+        samples += [('stage_duration_seconds', f'{labels},stage="{stage}"', duration)
+                    for stage, duration in sorted(stageDurations.items())]
+        samples += [(re.sub(r'(?<!^)([A-Z])', r'_\1', name).lower(), labels, value)
+                    for name, value in sorted(run.counters.items())]
+        return [(self.prefix + metric, labels, value) for metric, labels, value in samples]
+
+    def helpFor(self, metric: str) -> str:
+        name = metric[len(self.prefix):]
+        return self.helpTexts.get(name, f"Total {name.replace('_', ' ')} during the last run.")
+
+    def _writeTextfile(self, run: AppRun):
+        # Keep other apps' samples, node_exporter reads one file for all of them.
+        keptLines = []
+        if os.path.exists(self.textfilePath):
+            with open(self.textfilePath, 'r') as f:
+                keptLines = [line.rstrip("\n") for line in f
+                             if not line.startswith('#') and f'app="{run.app}"' not in line and line.strip()]
+
+        byMetric = {}
+        for line in keptLines:
+            byMetric.setdefault(line.split('{')[0].split(' ')[0], []).append(line)
+        for metric, labels, value in self._samples(run):
+            byMetric.setdefault(metric, []).append(f"{metric}{{{labels}}} {float(value)!r}")
+
+        output = []
+        for metric in sorted(byMetric):
+            output.append(f"# HELP {metric} {self.helpFor(metric)}")
+            output.append(f"# TYPE {metric} gauge")
+            output += sorted(byMetric[metric])
+        tmpPath = f"{self.textfilePath}.{os.getpid()}.tmp"
+        with open(tmpPath, 'w') as f:
+            f.write("\n".join(output) + "\n")
+        os.replace(tmpPath, self.textfilePath)
+
+# Configured from --metrics-jsonl / --metrics-textfile in __main__.
+metricsExporter = None
+
+def exportRunMetrics(run: AppRun):
+    if metricsExporter is not None:
+        try:
+            metricsExporter.export(run)
+        except (IOError, OSError) as e:
+            print(f"== Warning: Failed to export metrics for {run.app}: {e}")
+
+####################################################################################
+
+# On-disk HTTP cache shared by all fetches of a run (and across runs).
+# - Immutable artifacts (compose files at a tagged release URL) are stored already
+#   parsed and served forever without touching the network.
+# - Mutable endpoints (releases/latest, discussions) are stored with their ETag /
+#   Last-Modified and revalidated with a conditional request; a 304 skips the body.
+# Entries are evicted least-recently-used once the cache grows beyond maxBytes.
+# Several processes can share the directory (e.g. the daemon and a manual run): the
+# index is merged with the one on disk under a file lock whenever it is written, and
+# cache hits only update it in memory until the next write.
+class HttpCache:
+    def __init__(self, cacheDir: str = None, maxBytes: int = 64 * 1024 * 1024):
+        self.cacheDir = cacheDir
+        self.maxBytes = maxBytes
+        self.lock = threading.RLock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'bytesSaved': 0}
+        self.index = {}
+        self.dirty = False
+        if self.cacheDir:
+            os.makedirs(self.cacheDir, exist_ok=True)
+            self.indexPath = os.path.join(self.cacheDir, 'index.json')
+            self.index = self._readIndex()
+
+    def _readIndex(self) -> dict:
+        try:
+            with open(self.indexPath, 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _entryPath(self, key: str) -> str:
+        return os.path.join(self.cacheDir, key + '.json')
+
+    def _load(self, key: str):
+        try:
+            with open(self._entryPath(key), 'r') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            self.index.pop(key, None)
+            return None
+
+    def _writeAtomic(self, path: str, obj):
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmpPath, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmpPath, path)
+
+    def _touch(self, key: str):
+        self.index[key]['lastUsed'] = time.time()
+        self.dirty = True
+
+    def _store(self, key: str, url: str, entry: dict, meta: dict):
+        entry['url'] = url
+        self._writeAtomic(self._entryPath(key), entry)
+        meta['size'] = os.path.getsize(self._entryPath(key))
+        meta['lastUsed'] = time.time()
+        self.index[key] = meta
+        self._writeIndex()
+
+    def _writeIndex(self):
+        # Merges with entries other processes stored meanwhile, then evicts and writes.
+        import fcntl
+        with open(os.path.join(self.cacheDir, 'index.lock'), 'a') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            for key, meta in self._readIndex().items():
+                if key not in self.index or meta.get('lastUsed', 0) > self.index[key].get('lastUsed', 0):
+                    self.index[key] = meta
+            for key in [k for k in self.index if not os.path.exists(self._entryPath(k))]:
+                # Evicted, by this process or another one.
+                del self.index[key]
+            self._evict()
+            self._writeAtomic(self.indexPath, self.index)
+        self.dirty = False
+
+    def save(self):
+        # Writes the last-used times of cache hits, called once at the end of a run.
+        with self.lock:
+            if self.cacheDir and self.dirty:
+                self._writeIndex()
+
+    def _evict(self):
+        totalBytes = sum(m.get('size', 0) for m in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k].get('lastUsed', 0)):
+            if totalBytes <= self.maxBytes:
+                break
+            totalBytes -= self.index.pop(key).get('size', 0)
+            try:
+                os.remove(self._entryPath(key))
+            except OSError:
+                pass
+
+    def getImmutable(self, url: str, parse):
+        # Returns parse(body) for a URL whose content never changes.
+        with self.lock:
+            key = self.key(url)
+            if self.cacheDir and key in self.index and self.index[key].get('immutable'):
+                entry = self._load(key)
+                if entry is not None:
+                    self.stats['hits'] += 1
+                    self.stats['bytesSaved'] += self.index[key].get('bodySize', 0)
+                    recordCounter('cacheHits')
+                    recordCounter('cacheBytesSaved', self.index[key].get('bodySize', 0))
+                    self._touch(key)
+                    return entry['parsed']
+
+        response = httpClient.get(url)
+        response.raise_for_status()
+        parsed = parse(response.text)
+
+        recordCounter('cacheMisses')
+        with self.lock:
+            self.stats['misses'] += 1
+            # Only keep results that survive a JSON round trip unchanged, so a cached
+            # parse can never compare differently from a fresh one.
+            if self.cacheDir and json.loads(json.dumps(parsed, default=str)) == parsed:
+                self._store(key, url, {'parsed': parsed}, {'immutable': True, 'bodySize': len(response.content)})
+        return parsed
+
+    def getRevalidated(self, url: str, headers: dict = None) -> str:
+        # Returns the body of a mutable URL, revalidating a cached copy if there is one.
+        headers = dict(headers or {})
+        key = self.key(url)
+        cached = None
+        with self.lock:
+            if self.cacheDir and key in self.index and not self.index[key].get('immutable'):
+                cached = self._load(key)
+        if cached is not None:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('lastModified'):
+                headers['If-Modified-Since'] = cached['lastModified']
+
+        response = httpClient.get(url, headers=headers)
+        if cached is not None and response.status_code == 304:
+            recordCounter('cacheRevalidations')
+            recordCounter('cacheBytesSaved', len(cached['body'].encode()))
+            with self.lock:
+                self.stats['revalidations'] += 1
+                self.stats['bytesSaved'] += len(cached['body'].encode())
+                if key in self.index:
+                    self._touch(key)
+            return cached['body']
+        response.raise_for_status()
+
+        recordCounter('cacheMisses')
+        with self.lock:
+            self.stats['misses'] += 1
+            etag = response.headers.get('ETag')
+            lastModified = response.headers.get('Last-Modified')
+            if self.cacheDir and (etag or lastModified):
+                self._store(key, url, {'body': response.text, 'etag': etag, 'lastModified': lastModified}, {'immutable': False})
+        return response.text
+
+    def summary(self) -> str:
+        s = self.stats
+        return f"HTTP cache: {s['hits']} hits, {s['misses']} misses, {s['revalidations']} revalidations, {s['bytesSaved']} bytes saved"
+
+def defaultCacheDir() -> str:
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'conservativeContainerUpdate')
+
+# Disabled (pass-through) until __main__ configures it.
+httpCache = HttpCache()
+
+####################################################################################
+
+# Resolves image references to manifest digests with HEAD requests against the
+# registry's /v2 API, using the anonymous bearer token flow of ghcr.io and Docker
+# Hub. Restarts use it to pull only images whose digest isn't present locally, and
+# to notice tags that were re-pushed since they were pulled.
+registryEndpoints = {
+    'docker.io': 'https://registry-1.docker.io',
+}
+manifestMediaTypes = [
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+]
+
+def parseImageReference(image: str):
+    # Returns (registry, repository, tag, digest) following docker's defaults.
+    name, _, digest = image.partition('@')
+    tag = None
+    if name.rfind(':') > name.rfind('/'):
+        name, _, tag = name.rpartition(':')
+    first, sep, rest = name.partition('/')
+    if sep and ('.' in first or ':' in first or first == 'localhost'):
+        registry, repository = first, rest
+    else:
+        registry, repository = 'docker.io', name
+    if registry == 'docker.io' and '/' not in repository:
+        repository = 'library/' + repository
+    if tag is None and not digest:
+        tag = 'latest'
+    return registry, repository, tag, digest or None
+
+class RegistryClient:
+    def __init__(self, maxWorkers: int = 8):
+        self.maxWorkers = maxWorkers
+        self.lock = threading.Lock()
+        # (registry, repository) -> (token, expiry)
+        self.tokens = {}
+
+    @staticmethod
+    def baseUrl(registry: str) -> str:
+        return registryEndpoints.get(registry, f"https://{registry}")
+
+    def cachedToken(self, registry: str, repository: str):
+        with self.lock:
+            token, expiry = self.tokens.get((registry, repository), (None, 0))
+        return token if time.monotonic() < expiry else None
+
+    def fetchToken(self, registry: str, repository: str, challenge: str) -> str:
+        params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        if not challenge.lower().startswith('bearer') or 'realm' not in params:
+            raise ValueError(f"Unsupported registry auth challenge: {challenge!r}")
+        params.setdefault('scope', f"repository:{repository}:pull")
+        realm = params.pop('realm')
+        response = httpClient.get(realm, params=params)
+        response.raise_for_status()
+        data = response.json()
+        token = data.get('token') or data.get('access_token')
+        with self.lock:
+            # Refresh a little early, registries default to 60s tokens.
+            self.tokens[(registry, repository)] = (token, time.monotonic() + max(0, data.get('expires_in', 60) - 10))
+        return token
+
+    def resolveDigest(self, image: str) -> str:
+        registry, repository, tag, digest = parseImageReference(image)
+        if digest:
+            return digest
+        url = f"{self.baseUrl(registry)}/v2/{repository}/manifests/{tag}"
+        headers = {'Accept': ', '.join(manifestMediaTypes)}
+        token = self.cachedToken(registry, repository)
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        response = httpClient.request('HEAD', url, headers=headers)
+        if response.status_code == 401:
+            headers['Authorization'] = f"Bearer {self.fetchToken(registry, repository, response.headers.get('WWW-Authenticate', ''))}"
+            response = httpClient.request('HEAD', url, headers=headers)
+        response.raise_for_status()
+        digest = response.headers.get('Docker-Content-Digest')
+        if not digest:
+            # Not every registry returns the digest on HEAD, the digest of the manifest itself is the same.
+            response = httpClient.get(url, headers=headers)
+            response.raise_for_status()
+            digest = 'sha256:' + hashlib.sha256(response.content).hexdigest()
+        return digest
+
+    def resolveDigests(self, images: list) -> dict:
+        # image -> digest, None where the lookup failed.
+        def lookup(image):
+            try:
+                return self.resolveDigest(image)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                printAndLog(f"== Could not resolve the digest of {image}: {e}")
+                return None
+        images = sorted(set(images))
+        if not images:
+            return {}
+        with span('registryLookup', images=len(images)), ThreadPoolExecutor(max_workers=min(self.maxWorkers, len(images))) as executor:
+            futures = {image: submitInRun(executor, lookup, image) for image in images}
+            return {image: f.result() for image, f in futures.items()}
+
+# Replaced in __main__, set to None with --no-digest-check.
+registryClient = RegistryClient()
+
+####################################################################################
+
+# Container engine and systemd backends. Docker and Podman are driven through their
+# REST API on the engine's unix socket (Podman serves the Docker compatible API), so
+# pulls stream their progress and no process is spawned per call; systemd through
+# D-Bus with the optional jeepney package. Without the socket (or jeepney) the
+# docker/podman and systemctl CLIs are used instead. 'docker compose' has no API of
+# its own, so its 'config' and 'up' always run the CLI. Root containers (system
+# units, rootful sockets) are selected with --system.
+class EngineError(Exception):
+    pass
+
+def runCommand(cmd: List[str], cwd: str = None) -> str:
     try:
-        printAndLog(f"Running docker compose pull for file {composeFile} ...")
-        result = subprocess.run(['docker', 'compose', '-f', composeFile, 'pull'], capture_output=True, text=True, check=True, cwd=workingDir)
-        printAndLog(f"docker compose pull successfully. Output: {result.stdout.strip()}")
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, cwd=cwd)
     except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to do docker compose pull. Error: {e.stderr.strip()}")
-        notifyErrorAndExit(7)
+        raise EngineError((e.stderr or e.stdout or f"exit {e.returncode}").strip())
+    except OSError as e:
+        raise EngineError(str(e))
+    return result.stdout.strip()
+
+# Replaced in __main__, False with --no-engine-api.
+useEngineApi = True
+pullProgressInterval = 5
+
+def pullProgressPrinter(image: str):
+    # Callback for the streamed pull events, prints the download progress now and then.
+    layers = {}
+    lastPrint = [time.monotonic()]
+    def progress(event: dict):
+        detail = event.get('progressDetail') or {}
+        if event.get('id') and event.get('status') == 'Downloading' and detail.get('total'):
+            layers[event['id']] = (detail.get('current', 0), detail['total'])
+        elif event.get('id') in layers and event.get('status') in ('Download complete', 'Pull complete'):
+            layers[event['id']] = (layers[event['id']][1], layers[event['id']][1])
+        if layers and time.monotonic() - lastPrint[0] >= pullProgressInterval:
+            lastPrint[0] = time.monotonic()
+            current, total = sum(c for c, _ in layers.values()), sum(t for _, t in layers.values())
+            print(f"{currentRun().logPrefix}== Pulling {image}: {current / 1e6:.0f}/{total / 1e6:.0f} MB in {len(layers)} layer(s)")
+    return progress
+
+class CliContainerEngine:
+    def __init__(self, cli: str):
+        self.cli = cli
+        self.name = cli
+
+    def imageDigests(self, image: str) -> list:
+        # Repo digests of the local copy of image, None if it isn't present.
+        try:
+            output = runCommand([self.cli, 'image', 'inspect', '--format', '{{json .RepoDigests}}', image])
+        except EngineError:
+            return None
+        try:
+            repoDigests = json.loads(output.splitlines()[0]) or []
+        except (ValueError, IndexError):
+            return []
+        return [d.partition('@')[2] for d in repoDigests]
+
+    def pull(self, image: str, progress=None):
+        runCommand([self.cli, 'pull', '--quiet', image])
+
+    def containers(self, labelKey: str) -> list:
+        # (id, label value) of the containers that have the label.
+        labelFormat = f"{{{{.Labels.{labelKey}}}}}" if self.cli == 'podman' else f'{{{{.Label "{labelKey}"}}}}'
+        output = runCommand([self.cli, 'ps', '-a', '--no-trunc', '--filter', f"label={labelKey}", '--format', '{{.ID}} ' + labelFormat])
+        return [tuple(line.split(' ', 1)) for line in output.splitlines() if ' ' in line]
+
+    def inspectContainer(self, containerId: str) -> dict:
+        try:
+            return json.loads(runCommand([self.cli, 'inspect', containerId]))[0]
+        except (ValueError, IndexError) as e:
+            raise EngineError(f"Unexpected inspect output for {containerId}: {e}")
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socketPath: str, timeout: float = 60):
+        super().__init__('localhost', timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+class ApiContainerEngine:
+    # Pulls failing with one of these fall back to the CLI, which also knows credential helpers.
+    authErrorPattern = re.compile(r'unauthorized|denied|authentication required|HTTP 40[13]', re.IGNORECASE)
+
+    def __init__(self, socketPath: str, name: str):
+        self.socketPath = socketPath
+        self.cli = name
+        self.name = f"{name} API"
+
+    def request(self, method: str, path: str, params: dict = None, allowNotFound: bool = False, onEvent=None, headers: dict = None):
+        # JSON response of the engine, or the streamed JSON lines passed to onEvent.
+        connection = UnixHTTPConnection(self.socketPath, timeout=max(httpClient.readTimeout, 60))
+        try:
+            connection.request(method, path + ('?' + urllib.parse.urlencode(params) if params else ''), headers=headers or {})
+            response = connection.getresponse()
+            if response.status >= 400:
+                body = response.read()
+                if response.status == 404 and allowNotFound:
+                    return None
+                try:
+                    message = json.loads(body).get('message', body.decode())
+                except (ValueError, AttributeError):
+                    message = body.decode(errors='replace')
+                raise EngineError(f"{method} {path}: HTTP {response.status} {message}".strip())
+            if onEvent is None:
+                body = response.read()
+                return json.loads(body) if body else None
+            for line in response:
+                if line.strip():
+                    event = json.loads(line)
+                    if event.get('error'):
+                        raise EngineError(event['error'])
+                    onEvent(event)
+            return None
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise EngineError(f"{method} {path} on {self.socketPath}: {e}")
+        finally:
+            connection.close()
+
+    def imageDigests(self, image: str) -> list:
+        try:
+            data = self.request('GET', f"/images/{urllib.parse.quote(image, safe='/:@')}/json", allowNotFound=True)
+        except EngineError:
+            return None
+        return None if data is None else [d.partition('@')[2] for d in data.get('RepoDigests') or []]
+
+    def authFiles(self) -> list:
+        # Where 'docker login' / 'podman login' store credentials, in the order the CLI reads them.
+        dockerConfig = os.path.join(os.environ.get('DOCKER_CONFIG', os.path.expanduser('~/.docker')), 'config.json')
+        if self.cli != 'podman':
+            return [dockerConfig]
+        runtimeDir = os.environ.get('XDG_RUNTIME_DIR', f"/run/user/{os.getuid()}")
+        return [path for path in (os.environ.get('REGISTRY_AUTH_FILE'), os.path.join(runtimeDir, 'containers', 'auth.json'),
+                                  os.path.expanduser('~/.config/containers/auth.json'), dockerConfig) if path]
+
+    def registryAuth(self, registry: str) -> str:
+        # X-Registry-Auth header for registry from the login credentials, None without any.
+        import base64
+        names = [registry, f"https://{registry}", f"https://{registry}/v1/", f"https://{registry}/v2/"]
+        if registry == 'docker.io':
+            names += ['https://index.docker.io/v1/', 'index.docker.io', 'registry-1.docker.io']
+        for path in self.authFiles():
+            try:
+                with open(path, 'r') as f:
+                    auths = json.load(f).get('auths') or {}
+            except (IOError, ValueError, AttributeError):
+                continue
+            entry = next((auths[name] for name in names if name in auths), None)
+            if not entry:
+                continue
+            if entry.get('identitytoken'):
+                auth = {'identitytoken': entry['identitytoken'], 'serveraddress': registry}
+            elif entry.get('auth'):
+                try:
+                    username, _, password = base64.b64decode(entry['auth']).decode().partition(':')
+                except (ValueError, UnicodeDecodeError):
+                    continue
+                auth = {'username': username, 'password': password, 'serveraddress': registry}
+            else:
+                continue
+            return base64.urlsafe_b64encode(json.dumps(auth).encode()).decode()
+        return None
+
+    def pull(self, image: str, progress=None):
+        registry, _, _, _ = parseImageReference(image)
+        auth = self.registryAuth(registry)
+        try:
+            self.request('POST', '/images/create', {'fromImage': image}, onEvent=progress or (lambda event: None),
+                         headers={'X-Registry-Auth': auth} if auth else None)
+        except EngineError as e:
+            if not self.authErrorPattern.search(str(e)):
+                raise
+            printAndLog(f"== Pulling {image} through the {self.name} was denied ({e}), retrying with the {self.cli} CLI")
+            CliContainerEngine(self.cli).pull(image)
+
+    def containers(self, labelKey: str) -> list:
+        data = self.request('GET', '/containers/json', {'all': 'true', 'filters': json.dumps({'label': [labelKey]})})
+        return [(c['Id'], (c.get('Labels') or {}).get(labelKey, '')) for c in data or []]
+
+    def inspectContainer(self, containerId: str) -> dict:
+        return self.request('GET', f"/containers/{containerId}/json")
+
+def engineSocketPath(cli: str, system: bool) -> str:
+    if cli == 'docker':
+        dockerHost = os.environ.get('DOCKER_HOST', '')
+        return dockerHost[len('unix://'):] if dockerHost.startswith('unix://') else '/var/run/docker.sock'
+    if system:
+        return '/run/podman/podman.sock'
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR', f"/run/user/{os.getuid()}"), 'podman', 'podman.sock')
+
+_containerEngines = {}
+
+def getContainerEngine(cli: str, system: bool = False):
+    key = (cli, system)
+    if key not in _containerEngines:
+        socketPath = engineSocketPath(cli, system)
+        if useEngineApi and os.path.exists(socketPath):
+            _containerEngines[key] = ApiContainerEngine(socketPath, cli)
+        else:
+            _containerEngines[key] = CliContainerEngine(cli)
+    return _containerEngines[key]
+
+class SystemctlManager:
+    def __init__(self, system: bool = False):
+        self.scope = [] if system else ['--user']
+        self.name = 'systemctl'
+
+    def reload(self):
+        return runCommand(['systemctl', *self.scope, 'daemon-reload'])
+
+    def restart(self, unitName: str):
+        return runCommand(['systemctl', *self.scope, 'restart', unitName])
+
+    def dependencies(self, unitName: str) -> set:
+        output = runCommand(['systemctl', *self.scope, 'list-dependencies', '--plain', unitName])
+        return {line.strip() for line in output.splitlines() if line.strip()}
+
+class DbusSystemdManager:
+    dependencyProperties = ['Requires', 'Requisite', 'Wants', 'BindsTo', 'ConsistsOf']
+    jobTimeout = 600
+
+    def __init__(self, system: bool = False):
+        from jeepney.io.blocking import open_dbus_connection
+        self.connection = open_dbus_connection(bus='SYSTEM' if system else 'SESSION')
+        self.lock = threading.RLock()
+        self.name = 'D-Bus'
+
+    def call(self, method: str, signature: str = None, body: tuple = (), path: str = '/org/freedesktop/systemd1',
+             interface: str = 'org.freedesktop.systemd1.Manager'):
+        from jeepney import DBusAddress, new_method_call, MessageType
+        address = DBusAddress(path, bus_name='org.freedesktop.systemd1', interface=interface)
+        with self.lock:
+            reply = self.connection.send_and_get_reply(new_method_call(address, method, signature, body), timeout=self.jobTimeout)
+        if reply.header.message_type == MessageType.error:
+            raise EngineError(f"{method}: {' '.join(map(str, reply.body))}")
+        return reply.body
+
+    def reload(self):
+        self.call('Reload')
+        return ''
+
+    def restart(self, unitName: str):
+        # Waits for the restart job like systemctl does.
+        from jeepney import MatchRule, message_bus
+        from jeepney.io.blocking import Proxy
+        # Signals carry systemd's unique bus name, so only the bus side matches on the well-known sender.
+        signalRule = dict(type='signal', interface='org.freedesktop.systemd1.Manager', member='JobRemoved', path='/org/freedesktop/systemd1')
+        deadline = time.monotonic() + self.jobTimeout
+        with self.lock:
+            Proxy(message_bus, self.connection).AddMatch(MatchRule(sender='org.freedesktop.systemd1', **signalRule))
+            self.call('Subscribe')
+            with self.connection.filter(MatchRule(**signalRule)) as queue:
+                jobPath = self.call('RestartUnit', 'ss', (unitName, 'replace'))[0]
+                while True:
+                    try:
+                        message = self.connection.recv_until_filtered(queue, timeout=max(deadline - time.monotonic(), 0.01))
+                    except TimeoutError:
+                        raise EngineError(f"Timed out waiting for the restart job of {unitName}")
+                    jobId, path, unit, result = message.body
+                    if path == jobPath:
+                        break
+        if result != 'done':
+            raise EngineError(f"Job for {unitName} failed with result '{result}'")
+        return ''
+
+    def dependencies(self, unitName: str) -> set:
+        # Like list-dependencies: everything the unit pulls in, recursing into targets.
+        found, pending = set(), [unitName]
+        while pending:
+            unit = pending.pop()
+            unitPath = self.call('LoadUnit', 's', (unit,))[0]
+            for prop in self.dependencyProperties:
+                _, names = self.call('Get', 'ss', ('org.freedesktop.systemd1.Unit', prop), path=unitPath,
+                                     interface='org.freedesktop.DBus.Properties')[0]
+                for name in names:
+                    if name not in found:
+                        found.add(name)
+                        if name.endswith('.target'):
+                            pending.append(name)
+        return found
+
+_systemdManagers = {}
+
+def getSystemdManager(system: bool = False):
+    if system not in _systemdManagers:
+        manager = None
+        if useEngineApi:
+            try:
+                manager = DbusSystemdManager(system)
+            except ImportError:
+                pass
+            except Exception as e:
+                print(f"== Systemd D-Bus API not available ({e}), using systemctl")
+        _systemdManagers[system] = manager or SystemctlManager(system)
+    return _systemdManagers[system]
+
+# Restarts happen in three steps so the app is only down for the container swap:
+# pull all new images concurrently while the old containers keep running, verify
+# they are all present, and only then cycle the services. If a pull fails the
+# running app isn't touched.
+maxConcurrentPulls = 4
+
+def resolveImageReferences(app: str, newVersion: str, images: dict) -> dict:
+    # Upstream image references use the version variable, e.g. "immich-server:${IMMICH_VERSION:-release}".
+    versionVar = app_metadata[app]['versionEnvVariable']
+    pattern = re.compile(r'\$\{' + versionVar + r'(?::?[-?][^}]*)?\}|\$' + versionVar + r'\b')
+    return {service: pattern.sub(newVersion, image) for service, image in images.items()}
+
+def pullImage(engine, image: str, digest: str = None):
+    # Runs on a worker thread, so failures are returned instead of exiting.
+    with span('pull', image=image):
+        try:
+            engine.pull(image, pullProgressPrinter(image))
+        except EngineError as e:
+            return str(e)
+    localDigests = engine.imageDigests(image)
+    if localDigests is None:
+        return "image not present after pull"
+    if digest and localDigests and digest not in localDigests:
+        printAndLog(f"== {image} changed while it was pulled, got {', '.join(localDigests)} instead of {digest}")
+    return None
+
+def imagesToPull(engine, images: list) -> dict:
+    # image -> registry digest for the images not present locally in that digest.
+    digests = registryClient.resolveDigests(images) if registryClient else {}
+    with ThreadPoolExecutor(max_workers=max(1, min(maxConcurrentPulls, len(images)))) as executor:
+        localDigests = dict(zip(images, executor.map(lambda image: engine.imageDigests(image) if digests.get(image) else None, images)))
+    missing = {}
+    for image in images:
+        digest = digests.get(image)
+        if localDigests[image] and digest in localDigests[image]:
+            printAndLog(f"== {image} is already present ({digest}), skipping pull")
+            continue
+        if localDigests[image]:
+            printAndLog(f"== {image} was re-pushed: the registry has {digest}, the local copy is {', '.join(localDigests[image])}")
+            recordCounter('repushedImages')
+        missing[image] = digest
+    return missing
+
+def prePullImages(engine, images: list) -> bool:
+    images = imagesToPull(engine, sorted(set(images)))
+    if not images:
+        return True
+    printAndLog(f"== Pre-pulling {len(images)} image(s) with {engine.name} while the running containers stay up ...")
+    with span('prePull'), ThreadPoolExecutor(max_workers=min(maxConcurrentPulls, len(images))) as executor:
+        futures = {image: submitInRun(executor, pullImage, engine, image, digest) for image, digest in images.items()}
+        errors = {image: f.result() for image, f in futures.items()}
+    for image in images:
+        if errors[image]:
+            printAndLog(f"== Failed to pull {image}: {errors[image]}")
+        else:
+            printAndLog(f"== Pulled {image}")
+    recordCounter('pulledImages', sum(1 for e in errors.values() if not e))
+    return not any(errors.values())
 
+def cycleServices(description: str, action, exitCode: int = 8):
+    printAndLog(f"Running {description} ...")
+    start = time.perf_counter()
     try:
-        printAndLog(f"Running docker compose up for file {composeFile} ...")
-        result = subprocess.run(['docker', 'compose', '-f', composeFile, 'up'], capture_output=True, text=True, check=True, cwd=workingDir)
-        printAndLog(f"docker compose up successfully. Output: {result.stdout.strip()}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to do docker compose up. Error: {e.stderr.strip()}")
-        notifyErrorAndExit(7)
+        with span('cycle'):
+            output = action()
+    except EngineError as e:
+        printAndLog(f"Failed to run {description}. Error: {e}")
+        notifyErrorAndExit(exitCode)
+    downtime = time.perf_counter() - start
+    recordCounter('downtimeSeconds', downtime)
+    printAndLog(f"{description} successful. Output: {output}")
+    printAndLog(f"== Downtime: {downtime:.1f}s")
+
+def composeImages(composeFile: str) -> list:
+    # Images of the local compose file, with the updated env file already applied.
+    try:
+        output = runCommand(['docker', 'compose', '-f', composeFile, 'config', '--images'], cwd=os.path.dirname(composeFile))
+    except EngineError as e:
+        printAndLog(f"Failed to list images of {composeFile}. Error: {e}")
+        return None
+    return [line.strip() for line in output.splitlines() if line.strip()]
 
+def restartDockerCompose(composeFile: str, images: list = None, system: bool = False):
+    if not os.path.exists(composeFile):
+        printAndLog(f"== Error: File not found at '{composeFile}'")
+        notifyErrorAndExit(5)
+
+    images = composeImages(composeFile) or images or []
+    if not prePullImages(getContainerEngine('docker', system), images):
+        return False
+
+    # up -d only recreates the containers whose image or config changed.
+    cycleServices(f"docker compose up for file {composeFile}",
+                  lambda: runCommand(['docker', 'compose', '-f', composeFile, 'up', '-d'], cwd=os.path.dirname(composeFile)),
+                  exitCode=7)
+    return True
 
-def restartSystemdUnit(unitName: str):
+def restartSystemdUnit(unitName: str, images: list = None, system: bool = False):
+    if not prePullImages(getContainerEngine('podman', system), images or []):
+        return False
+
+    manager = getSystemdManager(system)
+    scope = 'system' if system else 'user'
     try:
-        printAndLog("Reloading user systemd daemon...")
-        result = subprocess.run(['systemctl', '--user', 'daemon-reload'], capture_output=True, text=True, check=True)
-        printAndLog(f"Daemon reload successful. Output: {result.stdout.strip()}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Failed to reload user systemd daemon. Error: {e.stderr.strip()}")
+        printAndLog(f"Reloading {scope} systemd daemon...")
+        output = manager.reload()
+        printAndLog(f"Daemon reload successful. Output: {output}")
+    except EngineError as e:
+        printAndLog(f"Failed to reload {scope} systemd daemon. Error: {e}")
         notifyErrorAndExit(7)
 
+    cycleServices(f"restart of {scope} service {unitName} ({manager.name})", lambda: manager.restart(unitName))
+    return True
+
+
+# After a restart, every container of the app must be running (and healthy, if it has
+# a healthcheck) and every HTTP probe must answer with a non-error status before the
+# deadline. Containers and probes are polled concurrently; the first failure stops
+# the others.
+healthPollInterval = 2
+
+def systemdUnitContainers(unitName: str, system: bool = False) -> list:
+    # Containers started by the unit or any unit it pulls in (quadlets label them with their unit).
     try:
-        printAndLog(f"Restarting user service: {unitName}...")
-        result = subprocess.run(['systemctl', '--user', 'restart', unitName], capture_output=True, text=True, check=True)
-        printAndLog(f"Service '{unitName}' restarted successfully. Output: {result.stdout.strip()}")
-    except subprocess.CalledProcessError as e:
-        printAndLog(f"Failed to restart service '{unitName}'. Error: {e.stderr.strip()}")
-        notifyErrorAndExit(8)
+        units = getSystemdManager(system).dependencies(unitName) | {unitName}
+        containers = getContainerEngine('podman', system).containers('PODMAN_SYSTEMD_UNIT')
+    except EngineError as e:
+        printAndLog(f"== Failed to list the containers of {unitName}: {e}")
+        return None
+    return [containerId for containerId, unit in containers if unit in units]
+
+def composeContainers(composeFile: str, system: bool = False) -> list:
+    # Compose labels its containers with the absolute paths of the compose files.
+    try:
+        containers = getContainerEngine('docker', system).containers('com.docker.compose.project.config_files')
+    except EngineError as e:
+        printAndLog(f"== Failed to list the containers of {composeFile}: {e}")
+        return None
+    paths = {os.path.abspath(composeFile), os.path.realpath(composeFile)}
+    return [containerId for containerId, configFiles in containers if paths & set(configFiles.split(','))]
+
+def containerState(engine, containerId: str):
+    # Returns (name, 'ready' | 'pending' | 'failed', detail).
+    try:
+        container = engine.inspectContainer(containerId)
+    except EngineError as e:
+        return containerId, 'failed', f"inspect failed: {e}"
+    state = container.get('State') or {}
+    status = state.get('Status', '')
+    health = (state.get('Health') or state.get('Healthcheck') or {}).get('Status', '')
+    name = (container.get('Name') or containerId).lstrip('/')
+    labels = (container.get('Config') or {}).get('Labels') or {}
+    # One-off ('compose run') and one-shot containers (init, migrations) are done, not failed.
+    if labels.get('com.docker.compose.oneoff') == 'True':
+        return name, 'ready', "one-off container, not checked"
+    if status == 'exited' and state.get('ExitCode') == 0:
+        return name, 'ready', "exited with code 0"
+    if status in ('exited', 'dead', 'stopped') or health == 'unhealthy':
+        return name, 'failed', f"{status} {health}".strip()
+    if status == 'running' and health in ('', 'healthy'):
+        return name, 'ready', f"{status} {health}".strip()
+    return name, 'pending', f"{status} {health}".strip()
+
+def probeUrl(url: str):
+    try:
+        response = httpClient.session.get(url, timeout=(httpClient.connectTimeout, httpClient.readTimeout))
+    except requests.exceptions.RequestException as e:
+        return url, 'pending', type(e).__name__
+    return url, 'ready' if response.status_code < 400 else 'pending', f"HTTP {response.status_code}"
+
+def waitUntilReady(check, failedEvent: threading.Event, deadline: float):
+    while True:
+        name, state, detail = check()
+        if state != 'pending' or failedEvent.is_set() or time.monotonic() + healthPollInterval > deadline:
+            return name, state, detail
+        failedEvent.wait(healthPollInterval)
+
+def verifyHealth(engine, containerIds: list, probes: list, timeout: float):
+    # Returns (healthy, seconds until healthy or failure).
+    start = time.monotonic()
+    deadline = start + timeout
+    if not containerIds:
+        # Nothing to verify doesn't mean healthy, e.g. a unit that isn't a quadlet.
+        printAndLog(f"== No containers of the app found, can't verify it")
+        return False, time.monotonic() - start
+    checks = [lambda c=c: containerState(engine, c) for c in containerIds] + [lambda u=u: probeUrl(u) for u in probes]
+    printAndLog(f"== Verifying {len(containerIds)} container(s) and {len(probes)} probe(s), waiting up to {timeout:.0f}s ...")
+    failedEvent = threading.Event()
+    healthy = True
+    with span('healthCheck'), ThreadPoolExecutor(max_workers=max(1, min(16, len(checks)))) as executor:
+        def run(check):
+            name, state, detail = waitUntilReady(check, failedEvent, deadline)
+            if state != 'ready':
+                failedEvent.set()
+            return name, state, detail
+        for name, state, detail in [f.result() for f in [submitInRun(executor, run, check) for check in checks]]:
+            if state == 'ready':
+                printAndLog(f"==   {name}: {detail}")
+            else:
+                healthy = False
+                printAndLog(f"==   {name}: NOT READY ({'timed out, ' if state == 'pending' else ''}{detail})")
+    return healthy, time.monotonic() - start
+
+def restartApp(args, images: list = None) -> bool:
+    if args.restart_systemd_unit:
+        with span('restart', unit=args.restart_systemd_unit):
+            return restartSystemdUnit(args.restart_systemd_unit, images, args.system)
+    elif args.restart_compose_file:
+        with span('restart', composeFile=args.restart_compose_file):
+            return restartDockerCompose(args.restart_compose_file, images, args.system)
+    return True
+
+def verifyRestartedApp(args) -> tuple:
+    if args.restart_systemd_unit:
+        engine, containerIds = getContainerEngine('podman', args.system), systemdUnitContainers(args.restart_systemd_unit, args.system)
+    else:
+        engine, containerIds = getContainerEngine('docker', args.system), composeContainers(args.restart_compose_file, args.system)
+    if containerIds is None:
+        return False, 0.0
+    return verifyHealth(engine, containerIds, probeUrlsFor(args), args.health_timeout)
 
+def probeUrlsFor(args) -> list:
+    probes = getattr(args, 'health_url', None) or []
+    return [probes] if isinstance(probes, str) else list(probes)
 
 ####################################################################################
 
-def immich_changelogBreakingChanges(baseVersionStr, newVersionStr):
-    url = "https://github.com/immich-app/immich/discussions?discussions_q=label%3Achangelog%3Abreaking-change+sort%3Adate_created"
-
+GITHUB_URL = "https://github.com"
+GITHUB_API_URL = "https://api.github.com"
+
+# Optional GitHub token, enables the GraphQL API and authenticates REST requests (set from --github-token in __main__).
+githubToken = None
+
+# A changelog source lists an app's breaking-change announcements, newest first, as
+# dicts with 'number' (increasing with creation), 'title' and 'url'. After the
+# generator is consumed, 'exhausted' tells whether it reached the oldest one.
+class ChangelogSource(ABC):
+    key = None
+    exhausted = False
+
+    @abstractmethod
+    def fetchNewestFirst(self):
+        pass
+
+class GitHubDiscussionsChangelogSource(ChangelogSource):
+    graphqlQuery = """
+        query($q: String!, $after: String) {
+          search(query: $q, type: DISCUSSION, first: 50, after: $after) {
+            pageInfo { hasNextPage endCursor }
+            nodes { ... on Discussion { number title url } }
+          }
+        }"""
+
+    def __init__(self, owner: str, repo: str, label: str, maxPages: int = 30):
+        self.owner = owner
+        self.repo = repo
+        self.label = label
+        self.maxPages = maxPages
+        self.key = f"{owner}-{repo}-{label}".replace('/', '_').replace(':', '_')
+
+    def fetchNewestFirst(self):
+        self.exhausted = False
+        if githubToken:
+            yield from self._fetchGraphQL()
+        else:
+            yield from self._fetchHtml()
+
+    def _fetchGraphQL(self):
+        variables = {'q': f'repo:{self.owner}/{self.repo} is:discussion label:"{self.label}" sort:created-desc', 'after': None}
+        headers = {"Authorization": f"Bearer {githubToken}"}
+        for _ in range(self.maxPages):
+            response = httpClient.post(f"{GITHUB_API_URL}/graphql", json={'query': self.graphqlQuery, 'variables': variables}, headers=headers)
+            response.raise_for_status()
+            result = response.json()
+            if result.get('errors'):
+                raise requests.exceptions.RequestException(f"GraphQL errors: {result['errors']}")
+            search = result['data']['search']
+            for node in search['nodes']:
+                if node:
+                    yield {'number': node['number'], 'title': node['title'], 'url': node['url']}
+            if not search['pageInfo']['hasNextPage']:
+                self.exhausted = True
+                return
+            variables['after'] = search['pageInfo']['endCursor']
+
+    def _fetchHtml(self):
+        # Without a token, scrape the discussions list (sorted newest first) page by page.
+        query = f"label%3A{self.label.replace(':', '%3A')}+sort%3Adate_created"
+        seen = set()
+        for page in range(1, self.maxPages + 1):
+            url = f"{GITHUB_URL}/{self.owner}/{self.repo}/discussions?discussions_q={query}&page={page}"
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(httpCache.getRevalidated(url), 'html.parser')
+            # This is not necessarily most reliable pattern
+            newOnPage = 0
+            for link in soup.select('a[data-hovercard-type="discussion"]'):
+                href = link.get('href') or ''
+                match = re.search(r'/discussions/(\d+)', href)
+                if not match or int(match.group(1)) in seen:
+                    continue
+                seen.add(int(match.group(1)))
+                newOnPage += 1
+                yield {
+                    'number': int(match.group(1)),
+                    'title': link.get_text(strip=True),
+                    'url': f"{GITHUB_URL}{href}" if href.startswith('/') else href,
+                }
+            if newOnPage == 0:
+                if page == 1:
+                    raise ValueError("Could not find discussion links on the page. HTML structure might have changed.")
+                self.exhausted = True
+                return
+
+# Local version -> announcement index for one changelog source, kept sorted by version
+# and persisted next to the HTTP cache. Each refresh only fetches announcements newer
+# than the newest one indexed (plus a full walk once a week to pick up relabeled ones),
+# and range queries are answered by binary search over the sorted versions.
+class BreakingChangeIndex:
+    versionPattern = re.compile(r'v?(\d+\.\d+\.\d+)')
+    fullRefreshInterval = timedelta(days=7)
+
+    def __init__(self, source: ChangelogSource, path: str = None):
+        self.source = source
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = []
+        self.versions = []
+        self.newestNumber = 0
+        self.complete = False
+        self.lastFullRefresh = None
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    saved = json.load(f)
+                self.newestNumber = saved['newestNumber']
+                self.complete = saved['complete']
+                self.lastFullRefresh = saved.get('lastFullRefresh')
+                self._setEntries(saved['entries'])
+            except (IOError, ValueError, KeyError) as e:
+                printAndLog(f"== Warning: Ignoring unreadable changelog index '{self.path}': {e}")
+
+    def _setEntries(self, entries):
+        self.entries = sorted(entries, key=lambda e: parseVersionString(e['version']))
+        self.versions = [parseVersionString(e['version']) for e in self.entries]
+
+    def _save(self):
+        if not self.path:
+            return
+        tmpPath = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmpPath, 'w') as f:
+            json.dump({'newestNumber': self.newestNumber, 'complete': self.complete,
+                       'lastFullRefresh': self.lastFullRefresh, 'entries': self.entries}, f, indent=1)
+        os.replace(tmpPath, self.path)
+
+    def refresh(self):
+        with self.lock:
+            now = datetime.now(timezone.utc)
+            fullWalk = not self.complete or self.lastFullRefresh is None or \
+                now - datetime.fromisoformat(self.lastFullRefresh) > self.fullRefreshInterval
+            byNumber = {e['number']: e for e in self.entries}
+            newestNumber = self.newestNumber
+            for item in self.source.fetchNewestFirst():
+                if not fullWalk and item['number'] <= self.newestNumber:
+                    break
+                newestNumber = max(newestNumber, item['number'])
+                match = self.versionPattern.search(item['title'])
+                if match and item['number'] not in byNumber:
+                    byNumber[item['number']] = dict(item, version=f"v{parseVersionString(match.group(1))}")
+            if fullWalk and self.source.exhausted:
+                self.complete = True
+                self.lastFullRefresh = now.isoformat()
+            self.newestNumber = newestNumber
+            self._setEntries(list(byNumber.values()))
+            self._save()
+
+    def covers(self, baseVersion) -> bool:
+        # The index is fetched newest first without gaps, so it covers everything after
+        # base once it is complete or already reaches below base.
+        return self.complete or (len(self.versions) > 0 and self.versions[0] < baseVersion)
+
+    def breakingChanges(self, baseVersion, newVersion) -> list:
+        # Announcements for versions in (baseVersion, newVersion].
+        return self.entries[bisect.bisect_right(self.versions, baseVersion):bisect.bisect_right(self.versions, newVersion)]
+
+_changelogIndexes = {}
+_changelogIndexesLock = threading.Lock()
+
+def GetBreakingChangeIndex(source: ChangelogSource) -> BreakingChangeIndex:
+    with _changelogIndexesLock:
+        if source.key not in _changelogIndexes:
+            path = os.path.join(httpCache.cacheDir, f"changelog-{source.key}.json") if httpCache.cacheDir else None
+            _changelogIndexes[source.key] = BreakingChangeIndex(source, path)
+        return _changelogIndexes[source.key]
+
+# Result of a check that couldn't decide (fetch failed, index incomplete). It blocks the
+# upgrade like a breaking change, but isn't a verdict to share or remember.
+checkUnknown = 'unknown'
+
+def ChangelogBreakingChanges(source: ChangelogSource, baseVersionStr, newVersionStr):
     try:
         baseVersion = parseVersionString(baseVersionStr.lstrip('v'))
         newVersion = parseVersionString(newVersionStr.lstrip('v'))
     except Exception as e:
         printAndLog(f"== Error parsing version strings: {e}. Ensure format like 'v1.132.0'.")
-        return True
+        return checkUnknown
 
     myassert(baseVersion < newVersion, "Base version must be older than the new version. No check performed.")
 
-    breakingChangesFound = []
-
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Updated selector: Look for h4 tags within a specific structure,
-        # or a more general link within a discussion item.
-        # GitHub often uses `h4` for discussion titles within list items or articles.
-        # This is not necessarily most reliable pattern
-        discussionLinks = soup.select('a[data-hovercard-type="discussion"]')
-        if not discussionLinks:
-            printAndLog("== Could not find discussion links on the page. HTML structure might have changed.")
-            printAndLog("== Please inspect the GitHub discussions page manually to verify the correct selector.")
-            return True
-
-        versionPattern = re.compile(r'v?(\d+\.\d+\.\d+)')
-
-        foundLowerVersion = False
-        for link in discussionLinks:
-            title = link.get_text(strip=True)
-            href = link.get('href')
-            fullUrl = f"https://github.com{href}" if href and href.startswith('/') else href
-
-            match = versionPattern.search(title)
-            if match:
-                discussionVersionStr = match.group(1)
-                try:
-                    discussionVersion = parseVersionString(discussionVersionStr)
-                    if discussionVersion < baseVersion:
-                        foundLowerVersion = True
-                    if baseVersion < discussionVersion <= newVersion:
-                        breakingChangesFound.append({
-                            'title': title,
-                            'version': f"v{discussionVersion}",
-                            'url': fullUrl
-                        })
-                except Exception as e:
-                    printAndLog(f"== Warning: Could not parse version '{discussionVersionStr}' from title '{title}': {e}")
-                    return True
-
-        if not foundLowerVersion:
-            printAndLog(f"== Warning: No parsed version lower than base version found. There *may* be breaking versions of page-2 that aren't scraped. Check manually.")
-            return True
-
+        index = GetBreakingChangeIndex(source)
+        index.refresh()
+    except RequestCancelled:
+        raise
     except requests.exceptions.RequestException as e:
-        printAndLog(f"== Error fetching URL: {e}")
-        return True
+        printAndLog(f"== Error fetching changelog: {e}")
+        return checkUnknown
     except Exception as e:
         printAndLog(f"== An unexpected error occurred: {e}")
-        return True
+        printAndLog("== Please inspect the GitHub discussions page manually.")
+        return checkUnknown
+
+    if not index.covers(baseVersion):
+        printAndLog(f"== Warning: Changelog index doesn't reach back to base version {baseVersionStr}. There *may* be breaking versions that weren't fetched. Check manually.")
+        return checkUnknown
 
+    breakingChangesFound = index.breakingChanges(baseVersion, newVersion)
     if breakingChangesFound:
         printAndLog(f"== Breaking change(s) found between {baseVersionStr} and {newVersionStr}:")
 
@@ -192,6 +1597,11 @@ def immich_changelogBreakingChanges(baseVersionStr, newVersionStr):
         printAndLog(f"== No breaking changes found between {baseVersionStr} and {newVersionStr}.")
         return False
 
+immichChangelogSource = GitHubDiscussionsChangelogSource('immich-app', 'immich', 'changelog:breaking-change')
+
+def immich_changelogBreakingChanges(baseVersionStr, newVersionStr):
+    return ChangelogBreakingChanges(immichChangelogSource, baseVersionStr, newVersionStr)
+
 ####################################################################################
 
 # Global app list
@@ -203,7 +1613,10 @@ app_metadata = {
         'tag2version' : lambda s: s,
         'validateVersion' : lambda s: re.fullmatch(r'^v\d+\.\d+\.\d+$', s) is not None,
         'versionEnvVariable' : 'IMMICH_VERSION',
+        'changelogSource' : immichChangelogSource,
         'changelogBreakingChanges' : immich_changelogBreakingChanges,
+        'allowRules' : [],
+        'composeCompanionFiles' : ['hwaccel.ml.yml', 'hwaccel.transcoding.yml'],
     },
     'authentik' : {
         'templateUrl' : 'https://raw.githubusercontent.com/goauthentik/authentik/refs/tags/version/<VERSION>/docker-compose.yml',
@@ -212,7 +1625,9 @@ app_metadata = {
         'tag2version' : lambda s: s.split('/')[1],
         'validateVersion' : lambda s: re.fullmatch(r'^202\d\.\d+\.\d+$', s) is not None,
         'versionEnvVariable' : 'AUTHENTIK_TAG',
-        'changelogBreakingChanges' : lambda b, n: (False, []),
+        'changelogSource' : None,
+        'changelogBreakingChanges' : lambda b, n: False,
+        'allowRules' : [],
     }
 }
 
@@ -251,49 +1666,160 @@ def updateEnvFile(filePath: str, lines: List[str], updatesDict: dict):
     myassert(numChanges == len(updatesDict), "Expected {} updates but only matched {} for file {}".format(len(updatesDict), numChanges, filePath))
 
     try:
-        with open(filePath, 'w') as f:
+        with span('envFileWrite', file=filePath), open(filePath, 'w') as f:
             f.writelines(updatedLines)
         printAndLog(f"== Successfully updated '{filePath}' with provided values.")
     except IOError as e:
         printAndLog(f"== Error writing to file '{filePath}': {e}")
         notifyErrorAndExit(5)
 
+def restoreEnvFile(filePath: str, lines: List[str]):
+    try:
+        with open(filePath, 'w') as f:
+            f.writelines(lines)
+        printAndLog(f"== Restored '{filePath}' to its previous content.")
+    except IOError as e:
+        printAndLog(f"== Error restoring file '{filePath}': {e}")
+        notifyErrorAndExit(5)
+
 ####################################################################################
 
+githubApiHeaders = {
+    "Accept": "application/vnd.github+json",
+    "X-GitHub-Api-Version": "2022-11-28"
+}
+
+def githubRestHeaders() -> dict:
+    # With a token the REST API allows 5000 instead of 60 requests per hour.
+    if githubToken:
+        return dict(githubApiHeaders, Authorization=f"Bearer {githubToken}")
+    return githubApiHeaders
+
+# Latest release, its publish time and the recent releases of every app_metadata repo,
+# fetched for all repos at once with one aliased GraphQL query (needs githubToken).
+# Batch and daemon runs then resolve 'latest' without a request per app; without a
+# token, or if the query fails, callers fall back to the REST API per repo.
+class ReleaseCatalog:
+    recentReleases = 30
+
+    def __init__(self, maxAge: float = 300):
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.repos = {}
+        self.fetchedAt = None
+
+    @staticmethod
+    def configuredRepos() -> list:
+        return sorted({(meta['owner'], meta['repo']) for meta in app_metadata.values()})
+
+    def buildQuery(self, repos: list):
+        params = ", ".join(f"$o{i}: String!, $n{i}: String!" for i in range(len(repos)))
+        fields = "".join(f"""
+          r{i}: repository(owner: $o{i}, name: $n{i}) {{
+            latestRelease {{ tagName publishedAt }}
+            releases(first: {self.recentReleases}, orderBy: {{field: CREATED_AT, direction: DESC}}) {{
+              nodes {{ tagName publishedAt isDraft isPrerelease }}
+            }}
+          }}""" for i in range(len(repos)))
+        variables = {}
+        for i, (owner, repo) in enumerate(repos):
+            variables[f"o{i}"], variables[f"n{i}"] = owner, repo
+        return f"query({params}) {{{fields}\n        }}", variables
+
+    def refresh(self):
+        repos = self.configuredRepos()
+        query, variables = self.buildQuery(repos)
+        with span('releaseCatalog', repos=len(repos)):
+            response = httpClient.post(f"{GITHUB_API_URL}/graphql", json={'query': query, 'variables': variables},
+                                       headers={"Authorization": f"Bearer {githubToken}"})
+            response.raise_for_status()
+            result = response.json()
+        # A repo that doesn't exist shows up in 'errors' with its alias null, the others are still usable.
+        data = result.get('data') or {}
+        if not data:
+            raise requests.exceptions.RequestException(f"GraphQL errors: {result.get('errors')}")
+        self.repos = {}
+        for i, key in enumerate(repos):
+            repository = data.get(f"r{i}")
+            if not repository:
+                continue
+            latest = repository.get('latestRelease')
+            self.repos[key] = {
+                'latest': {'tag_name': latest['tagName'], 'published_at': latest['publishedAt']} if latest else None,
+                'releases': [{'tag_name': r['tagName'], 'published_at': r['publishedAt'], 'draft': r['isDraft'],
+                              'prerelease': r['isPrerelease']} for r in repository['releases']['nodes']],
+            }
+        print(f"== Resolved releases of {len(self.repos)} repo(s) with one GraphQL query")
+
+    def get(self, owner: str, repo: str):
+        if not githubToken:
+            return None
+        with self.lock:
+            # Also after a failure, so the other apps of a batch don't retry it right away.
+            if self.fetchedAt is None or time.monotonic() - self.fetchedAt > self.maxAge:
+                self.fetchedAt = time.monotonic()
+                try:
+                    self.refresh()
+                except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+                    raiseIfCancelled()
+                    self.repos = {}
+                    printAndLog(f"== Warning: Batched release lookup failed, falling back to the REST API: {e}")
+            return self.repos.get((owner, repo))
+
+    def latest(self, owner: str, repo: str):
+        entry = self.get(owner, repo)
+        return entry['latest'] if entry else None
+
+    def releases(self, owner: str, repo: str):
+        entry = self.get(owner, repo)
+        return entry['releases'] if entry else None
+
+releaseCatalog = ReleaseCatalog()
+
 def GetLatestGitHubReleaseTag(owner, repo):
-    url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
-    headers = {
-        "Accept": "application/vnd.github+json",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
+    releaseData = releaseCatalog.latest(owner, repo)
+    if releaseData:
+        print(f"== Got tag: {releaseData['tag_name']} (batched)")
+        print(f"== Released At: {releaseData['published_at']}")
+        return releaseData['tag_name'], releaseData['published_at']
+    url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/releases/latest"
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        releaseData = response.json()
+        releaseData = json.loads(httpCache.getRevalidated(url, headers=githubRestHeaders()))
         print(f"== Tried URL : {url}")
         print(f"== Got tag: " + releaseData.get('tag_name'))
         print(f"== Released At: " + releaseData.get('published_at'))
         #return releaseData.get('tag_name')
         return releaseData.get('tag_name'), releaseData.get('published_at')
     except requests.exceptions.RequestException as e:
-        printAndLog(f"== ERROR: Failed to fetch latest release for {owner}/{repo}: {e}", file=sys.stderr)
+        printAndLog(f"== ERROR: Failed to fetch latest release for {owner}/{repo}: {e}")
         notifyErrorAndExit(1) # Exit if we can't get the latest tag
     except json.JSONDecodeError as e:
-        printAndLog(f"== ERROR: Failed to parse JSON response from GitHub API for {owner}/{repo}: {e}", file=sys.stderr)
+        printAndLog(f"== ERROR: Failed to parse JSON response from GitHub API for {owner}/{repo}: {e}")
         notifyErrorAndExit(2)
 
-def DownloadAndParseComposeFile(url):
+def parseComposeYaml(text: str):
+    import yaml
+    with span('yamlParse', bytes=len(text)):
+        return yaml.safe_load(text)
+
+def DownloadAndParseComposeFiles(urls: list, companionFiles: list = ()) -> list:
+    # The compose models of urls, see loadComposeModels.
+    import yaml
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        return yaml.safe_load(response.text)
+        return loadComposeModels(urls, companionFiles)
+    except RequestCancelled:
+        raise
     except requests.exceptions.RequestException as e:
-        printAndLog(f"== ERROR: Failed to download {url}: {e}", file=sys.stderr)
+        raiseIfCancelled()
+        printAndLog(f"== ERROR: Failed to download {' or '.join(urls)}: {e}")
         notifyErrorAndExit(1) # Exit with code 1 for download failure
-    except yaml.YAMLError as e:
-        printAndLog(f"== ERROR: Failed to parse YAML from {url}: {e}", file=sys.stderr)
+    except (yaml.YAMLError, ValueError) as e:
+        printAndLog(f"== ERROR: Failed to parse YAML from {' or '.join(urls)}: {e}")
         notifyErrorAndExit(2) # Exit with code 2 for YAML parsing failure
 
+def DownloadAndParseComposeFile(url, companionFiles: list = ()):
+    return DownloadAndParseComposeFiles([url], companionFiles)[0]
+
 def RemoveImageTags(composeData):
     extractedImages = {}
     if isinstance(composeData, dict) and 'services' in composeData:
@@ -303,68 +1829,820 @@ def RemoveImageTags(composeData):
                     extractedImages[serviceName] = serviceConfig.pop('image')
     return extractedImages
 
-def CompareDockerCompose(templateUrl, version1, version2):
+####################################################################################
+
+# Multi-file compose setups. The compose model of a release is its main file with the
+# files it references at the same version merged in: 'include:' entries and the
+# 'extends.file' of services, relative to the referencing file. The app's companion
+# files (e.g. immich's hwaccel files, which local setups extend from) are part of the
+# model as well. Files are fetched concurrently as soon as a reference to them is seen,
+# and concurrent or repeated loads of a URL share one fetch (missing files aren't
+# remembered, release assets can be uploaded late). Releases usually keep their file
+# layout, so the references of one version's main file are prefetched for the other
+# versions loaded with it: with the base version cached, as in the usual run, the
+# referenced files of the new version cost no extra round trip. With nothing cached
+# they need one more round trip per level of nesting, as they are only known once
+# the file referencing them arrived.
+maxConcurrentComposeFetches = 4
+maxMemoizedComposeFiles = 256
+companionFilesKey = 'x-companion-files'
+composeSections = ('services', 'volumes', 'networks', 'configs', 'secrets')
+_composeFileMemo = {}
+_composeFileMemoLock = threading.Lock()
+
+def fetchComposeFile(url: str, optional: bool = False):
+    # Parsed file, or None for an optional file that doesn't exist at this version.
+    # Callers get their own copy, they strip and merge it in place.
+    with _composeFileMemoLock:
+        future = _composeFileMemo.get(url)
+        fetching = future is None
+        if fetching:
+            future = _composeFileMemo[url] = Future()
+    if fetching:
+        try:
+            with span('composeDownload', url=url):
+                future.set_result(httpCache.getImmutable(url, parseComposeYaml))
+            with _composeFileMemoLock:
+                while len(_composeFileMemo) > maxMemoizedComposeFiles:
+                    del _composeFileMemo[next(iter(_composeFileMemo))]
+        except BaseException as e:
+            with _composeFileMemoLock:
+                _composeFileMemo.pop(url, None)
+            if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code == 404:
+                future.set_result(None)
+            else:
+                future.set_exception(e)
+    try:
+        composeData = future.result()
+    except RequestCancelled:
+        if fetching:
+            raise
+        # The run that was fetching it got cancelled, not this one.
+        return fetchComposeFile(url, optional)
+    if composeData is None and not optional:
+        raise requests.exceptions.HTTPError(f"404 Not Found: {url}")
+    return copy.deepcopy(composeData)
+
+def composeReferences(composeData) -> list:
+    # Relative paths of the files included or extended from; absolute or templated
+    # paths point outside the release and aren't followed.
+    if not isinstance(composeData, dict):
+        return []
+    paths = []
+    for entry in composeData.get('include') or []:
+        entryPaths = entry.get('path') if isinstance(entry, dict) else entry
+        paths += [entryPaths] if isinstance(entryPaths, str) else list(entryPaths or [])
+    services = composeData.get('services')
+    for config in (services.values() if isinstance(services, dict) else []):
+        extends = config.get('extends') if isinstance(config, dict) else None
+        if isinstance(extends, dict) and isinstance(extends.get('file'), str):
+            paths.append(extends['file'])
+    return [p for p in paths if isinstance(p, str) and not p.startswith(('/', '~')) and '$' not in p and '://' not in p]
+
+def fetchComposeFiles(urls: list, companionFiles: list = ()) -> dict:
+    # url -> parsed file of the main files, their companion files and everything they reference.
+    files = {}
+    pending = {}
+    with ThreadPoolExecutor(max_workers=maxConcurrentComposeFetches) as executor:
+        def fetch(fileUrl: str):
+            if fileUrl not in files and fileUrl not in pending.values():
+                pending[submitInRun(executor, fetchComposeFile, fileUrl, fileUrl not in urls)] = fileUrl
+        for url in urls:
+            fetch(url)
+            for name in companionFiles:
+                fetch(urllib.parse.urljoin(url, name))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fileUrl = pending.pop(future)
+                files[fileUrl] = future.result()
+                for path in composeReferences(files[fileUrl]):
+                    for baseUrl in (urls if fileUrl in urls else [fileUrl]):
+                        fetch(urllib.parse.urljoin(baseUrl, path))
+    return files
+
+def mergeComposeValues(base, override, key: str = None):
+    # Compose's merge rules for extends: mappings are merged, commands are replaced,
+    # other sequences are appended.
+    if key in ComposeDiffEngine.keyValueKeys and base is not None and override is not None:
+        return {**ComposeDiffEngine._keyValues(base), **ComposeDiffEngine._keyValues(override)}
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for k, v in override.items():
+            merged[k] = mergeComposeValues(base[k], v, k) if k in base else v
+        return merged
+    if isinstance(base, list) and isinstance(override, list) and key not in ('command', 'entrypoint', 'test'):
+        return base + [v for v in override if v not in base]
+    return override
+
+def resolveComposeService(files: dict, fileUrl: str, serviceName: str, stack: tuple = ()):
+    composeData = files.get(fileUrl)
+    services = composeData.get('services') if isinstance(composeData, dict) else None
+    config = copy.deepcopy(services.get(serviceName)) if isinstance(services, dict) else None
+    if not isinstance(config, dict) or 'extends' not in config:
+        return config
+    if (fileUrl, serviceName) in stack:
+        raise ValueError(f"Circular extends of service {serviceName} in {fileUrl}")
+    extends = config['extends']
+    if isinstance(extends, str):
+        extends = {'service': extends}
+    baseUrl = urllib.parse.urljoin(fileUrl, extends['file']) if extends.get('file') else fileUrl
+    base = resolveComposeService(files, baseUrl, extends.get('service'), stack + ((fileUrl, serviceName),)) if baseUrl in files else None
+    if base is None:
+        # Not resolvable here (outside the release or missing), compared as written.
+        return config
+    del config['extends']
+    return mergeComposeValues(base, config)
+
+def resolveComposeModel(files: dict, fileUrl: str, stack: tuple = ()):
+    composeData = copy.deepcopy(files.get(fileUrl))
+    if not isinstance(composeData, dict):
+        return composeData
+    if fileUrl in stack:
+        raise ValueError(f"Circular include of {fileUrl}")
+    if isinstance(composeData.get('services'), dict):
+        for serviceName in composeData['services']:
+            composeData['services'][serviceName] = resolveComposeService(files, fileUrl, serviceName)
+    for path in composeReferences({'include': composeData.get('include')}):
+        included = resolveComposeModel(files, urllib.parse.urljoin(fileUrl, path), stack + (fileUrl,))
+        if not isinstance(included, dict):
+            continue
+        for section in composeSections:
+            if isinstance(included.get(section), dict):
+                # Definitions of the including file take precedence.
+                composeData[section] = {**included[section], **(composeData.get(section) or {})}
+    return composeData
+
+def loadComposeModels(urls: list, companionFiles: list = ()) -> list:
+    files = fetchComposeFiles(urls, companionFiles)
+    models = []
+    for url in urls:
+        composeData = resolveComposeModel(files, url)
+        if companionFiles and isinstance(composeData, dict):
+            composeData[companionFilesKey] = {name: resolveComposeModel(files, urllib.parse.urljoin(url, name)) for name in companionFiles}
+        models.append(composeData)
+    return models
+
+def loadComposeModel(url: str, companionFiles: list = ()):
+    return loadComposeModels([url], companionFiles)[0]
+
+def composeCompanionFiles(app: str) -> list:
+    return app_metadata[app].get('composeCompanionFiles', [])
+
+####################################################################################
+
+_absent = object()
+
+# Compose comparison engine. Every service (and every other top level section) is
+# brought into a canonical form first, so equivalent spellings compare equal: sorted
+# maps, list/map forms of environment, labels and depends_on merged, short port and
+# volume syntax expanded, string commands split, durations in seconds. Each unit gets
+# a content hash; only units whose hashes differ are deep diffed, and changes matching
+# an allow rule (fnmatch patterns on dotted paths like 'services.*.healthcheck.interval',
+# a rule also covers everything below its path) are reported as benign.
+class ComposeDiffEngine:
+    durationKeys = {'interval', 'timeout', 'start_period', 'start_interval', 'stop_grace_period'}
+    keyValueKeys = {'environment', 'labels', 'annotations', 'sysctls', 'extra_hosts', 'build_args'}
+    unorderedListKeys = {'cap_add', 'cap_drop', 'expose', 'group_add',
+                         'security_opt', 'devices', 'profiles', 'secrets', 'configs', 'tmpfs', 'links'}
+    # Order matters here: later env files override earlier ones, DNS servers are tried in order.
+    orderedListKeys = {'dns', 'dns_search', 'env_file'}
+    durationPattern = re.compile(r'(\d+(?:\.\d+)?)(us|ms|s|m|h)')
+    durationUnits = {'us': 1e-6, 'ms': 1e-3, 's': 1, 'm': 60, 'h': 3600}
+
+    def __init__(self, allowRules: list = ()):
+        self.allowRules = list(allowRules)
+
+    @staticmethod
+    def _scalar(v):
+        if isinstance(v, bool):
+            return 'true' if v else 'false'
+        return v if v is None or isinstance(v, str) else str(v)
+
+    @classmethod
+    def _keyValues(cls, value):
+        if isinstance(value, dict):
+            return {str(k): cls._scalar(v) for k, v in value.items()}
+        result = {}
+        for item in value or []:
+            key, sep, v = str(item).partition('=')
+            if not sep and ':' in key:
+                # extra_hosts short form "host:ip"
+                key, sep, v = key.partition(':')
+            result[key.strip()] = v if sep else None
+        return result
+
+    @classmethod
+    def _duration(cls, value):
+        if isinstance(value, str):
+            parts = cls.durationPattern.findall(value)
+            if parts and ''.join(n + u for n, u in parts) == value.replace(' ', ''):
+                return round(sum(float(n) * cls.durationUnits[u] for n, u in parts), 6)
+        return value
+
+    @staticmethod
+    def _port(port):
+        if isinstance(port, dict):
+            long = {k: ComposeDiffEngine._scalar(v) for k, v in port.items()}
+            long.setdefault('protocol', 'tcp')
+            return long
+        spec, _, protocol = str(port).partition('/')
+        parts = spec.rsplit(':', 2)
+        long = {'target': parts[-1], 'protocol': protocol or 'tcp'}
+        if len(parts) >= 2:
+            long['published'] = parts[-2]
+        if len(parts) == 3:
+            long['host_ip'] = parts[0].strip('[]')
+        return long
+
+    @staticmethod
+    def _volume(volume):
+        if isinstance(volume, dict):
+            return {k: ComposeDiffEngine._scalar(v) if not isinstance(v, dict) else v for k, v in volume.items()}
+        parts = str(volume).split(':')
+        if len(parts) == 1:
+            return {'type': 'volume', 'target': parts[0]}
+        source, target = parts[0], parts[1]
+        long = {'type': 'bind' if source.startswith(('/', '.', '~', '$')) else 'volume', 'source': source, 'target': target}
+        modes = parts[2].split(',') if len(parts) > 2 else []
+        if 'ro' in modes:
+            long['read_only'] = 'true'
+        otherModes = sorted(m for m in modes if m not in ('ro', 'rw'))
+        if otherModes:
+            long['mode'] = ','.join(otherModes)
+        return long
+
+    @classmethod
+    def canonicalService(cls, config):
+        if not isinstance(config, dict):
+            return config
+        canonical = {}
+        for key, value in config.items():
+            if key in cls.keyValueKeys:
+                value = cls._keyValues(value)
+            elif key == 'ports':
+                value = sorted((cls._port(p) for p in value or []), key=lambda p: json.dumps(p, sort_keys=True))
+            elif key == 'volumes':
+                value = sorted((cls._volume(v) for v in value or []), key=lambda v: str(v.get('target')))
+            elif key == 'depends_on' and isinstance(value, list):
+                value = {name: {'condition': 'service_started'} for name in value}
+            elif key == 'networks' and isinstance(value, list):
+                value = {name: None for name in value}
+            elif key in ('command', 'entrypoint') and isinstance(value, str):
+                try:
+                    value = shlex.split(value)
+                except ValueError:
+                    pass
+            elif key == 'healthcheck' and isinstance(value, dict):
+                value = {k: cls._duration(v) if k in cls.durationKeys else v for k, v in value.items()}
+                if isinstance(value.get('test'), str):
+                    value['test'] = ['CMD-SHELL', value['test']]
+            elif key in cls.durationKeys:
+                value = cls._duration(value)
+            elif key in cls.unorderedListKeys:
+                value = sorted(cls._scalar(v) for v in ([value] if isinstance(value, str) else value or []))
+            elif key in cls.orderedListKeys:
+                value = [cls._scalar(v) for v in ([value] if isinstance(value, str) else value or [])]
+            canonical[key] = value
+        return canonical
+
+    @classmethod
+    def canonicalUnits(cls, composeData) -> dict:
+        # Comparison units of an image-stripped compose model: one per service, one per
+        # other top level key, and those of every companion file prefixed with its name.
+        units = {}
+        if not isinstance(composeData, dict):
+            return {'': composeData}
+        for key, value in composeData.items():
+            if key == 'services' and isinstance(value, dict):
+                for serviceName, serviceConfig in value.items():
+                    units[f"services.{serviceName}"] = cls.canonicalService(serviceConfig)
+            elif key == companionFilesKey and isinstance(value, dict):
+                for fileName, fileData in value.items():
+                    units.update({f"{fileName}:{name}": unit for name, unit in cls.canonicalUnits(fileData).items()})
+            else:
+                units[str(key)] = value
+        return units
+
+    @staticmethod
+    def hashUnit(unit) -> str:
+        return hashlib.sha256(json.dumps(unit, sort_keys=True, default=str).encode()).hexdigest()
+
+    @classmethod
+    def fingerprint(cls, units: dict) -> dict:
+        return {name: cls.hashUnit(unit) for name, unit in units.items()}
+
+    @classmethod
+    def deepDiff(cls, a, b, path: str) -> list:
+        if a == b:
+            return []
+        if isinstance(a, dict) and isinstance(b, dict):
+            changes = []
+            for key in sorted(set(a) | set(b), key=str):
+                changes += cls.deepDiff(a.get(key, _absent), b.get(key, _absent), f"{path}.{key}")
+            return changes
+        return [(path, a, b)]
+
+    def allowRuleFor(self, path: str):
+        for rule in self.allowRules:
+            if fnmatch.fnmatchcase(path, rule) or fnmatch.fnmatchcase(path, rule + '.*'):
+                return rule
+        return None
+
+    def compare(self, units1: dict, units2: dict, fingerprint1: dict = None, fingerprint2: dict = None):
+        # Returns (breakingChanges, benignChanges) as lists of (path, old, new[, rule]).
+        fingerprint1 = fingerprint1 or self.fingerprint(units1)
+        fingerprint2 = fingerprint2 or self.fingerprint(units2)
+        breaking, benign = [], []
+        for name in sorted(set(fingerprint1) | set(fingerprint2)):
+            if fingerprint1.get(name) == fingerprint2.get(name):
+                continue
+            for path, old, new in self.deepDiff(units1.get(name, _absent), units2.get(name, _absent), name):
+                rule = self.allowRuleFor(path)
+                if rule is None:
+                    breaking.append((path, old, new))
+                else:
+                    benign.append((path, old, new, rule))
+        return breaking, benign
+
+def formatComposeValue(value) -> str:
+    return "<absent>" if value is _absent else json.dumps(value, default=str)
+
+def composeFingerprint(composeData) -> dict:
+    # Per unit hashes of the compose file without its image tags.
+    data = copy.deepcopy(composeData)
+    RemoveImageTags(data)
+    return ComposeDiffEngine.fingerprint(ComposeDiffEngine.canonicalUnits(data))
+
+def CompareDockerCompose(app, version1, version2, allowRules: list = ()):
+    # The compose check of EvaluateBreakingChanges on its own.
+    templateUrl = app_metadata[app]['templateUrl']
     url1 = templateUrl.replace("<VERSION>", version1)
     url2 = templateUrl.replace("<VERSION>", version2)
 
     printAndLog(f"== Processing docker-compose.yml for {version1} from: {url1}")
-    composeData1 = DownloadAndParseComposeFile(url1)
-
     printAndLog(f"== Processing docker-compose.yml for {version2} from: {url2}")
-    composeData2 = DownloadAndParseComposeFile(url2)
-
+    composeData1, composeData2 = DownloadAndParseComposeFiles([url1, url2], composeCompanionFiles(app))
+
+    return CompareComposeVersions(app, version1, composeData1, version2, composeData2, allowRules)
+
+def CompareComposeVersions(app, version1, composeData1, version2, composeData2, allowRules: list = ()):
+    # Compares with the fingerprints stored for known versions, so unchanged services are skipped.
+    store = GetComposeFingerprintStore()
+    fingerprints = []
+    for version, composeData in ((version1, composeData1), (version2, composeData2)):
+        fingerprint = store.get(app, version)
+        if fingerprint is None:
+            fingerprint = composeFingerprint(composeData)
+            store.put(app, version, fingerprint)
+        fingerprints.append(fingerprint)
+    return CompareComposeData(composeData1, composeData2, allowRules, *fingerprints)
+
+def CompareComposeData(composeData1, composeData2, allowRules: list = (), fingerprint1: dict = None, fingerprint2: dict = None):
     # Extract and remove image tags from both datasets directly
     extractedImages1 = RemoveImageTags(composeData1)
     extractedImages2 = RemoveImageTags(composeData2)
 
-    # Now, compare the entire compose files except the image tags
-    #nonImageDiff = DeepDiff(composeData1, composeData2, ignore_order=True, view='tree')
-    nonImageDiff = jsondiff.diff(composeData1, composeData2, syntax='symmetric')
-
-    if nonImageDiff:
+    # Now, compare the entire compose files except the image tags, service by service
+    engine = ComposeDiffEngine(allowRules)
+    with span('composeDiff'):
+        breakingChanges, benignChanges = engine.compare(ComposeDiffEngine.canonicalUnits(composeData1),
+                                                        ComposeDiffEngine.canonicalUnits(composeData2),
+                                                        fingerprint1, fingerprint2)
+
+    if benignChanges:
+        printAndLog("== Changes allowed by allow rules:")
+        for path, old, new, rule in benignChanges:
+            printAndLog(f"==   {path}: {formatComposeValue(old)} -> {formatComposeValue(new)} (rule '{rule}')")
+
+    imageChanges = []
+    allServiceNames = sorted(list(set(extractedImages1.keys()).union(set(extractedImages2.keys()))))
+    for serviceName in allServiceNames:
+        image1 = extractedImages1.get(serviceName)
+        image2 = extractedImages2.get(serviceName)
+        if image1 != image2:
+            imageChanges.append(f"==   Service: {serviceName} \n    Old Image: {image1}\n    New Image: {image2}")
+
+    if breakingChanges:
         printAndLog("== ## BREAKING CHANGE DETECTED: Structural or non-image related differences")
         printAndLog("== ---")
         printAndLog("== Differences found (excluding 'image' tags):")
-        #printAndLog(nonImageDiff.pretty())
-        printAndLog(yaml.dump(nonImageDiff, indent=2, default_flow_style=False))
+        for path, old, new in breakingChanges:
+            printAndLog(f"==   {path}: {formatComposeValue(old)} -> {formatComposeValue(new)}")
         # Optionally, print image changes too if there are breaking changes
         printAndLog("== ### Image changes (if any, alongside breaking changes)")
-        imageChangesFound = False
-        allServiceNames = sorted(list(set(extractedImages1.keys()).union(set(extractedImages2.keys()))))
-        for serviceName in allServiceNames:
-            image1 = extractedImages1.get(serviceName)
-            image2 = extractedImages2.get(serviceName)
-            if image1 != image2:
-                printAndLog(f"==   Service: {serviceName} \n    Old Image: {image1}\n    New Image: {image2}")
-                imageChangesFound = True
-        if not imageChangesFound:
+        for imageChange in imageChanges:
+            printAndLog(imageChange)
+        if not imageChanges:
             printAndLog("==   No image changes detected.")
         return True, None 
 
     else:
-        # If no non-image differences, check if images themselves changed
-        imageChangesFound = False
-        allServiceNames = sorted(list(set(extractedImages1.keys()).union(set(extractedImages2.keys()))))
-
         printAndLog("== ## Summary of Image Changes (if any)")
         printAndLog("== ---")
-        for serviceName in allServiceNames:
-            image1 = extractedImages1.get(serviceName)
-            image2 = extractedImages2.get(serviceName)
-            if image1 != image2:
-                printAndLog(f"==   Service: {serviceName} \n    Old Image: {image1}\n    New Image: {image2}")
-                imageChangesFound = True
-
-        if imageChangesFound:
+        for imageChange in imageChanges:
+            printAndLog(imageChange)
+
+        if imageChanges:
             printAndLog("== Only `image` tags were changed across all services. No structural or other changes detected.")
         else:
             printAndLog("== No changes detected between the two Docker Compose files.")
         return False, extractedImages2
 
+# Runs the changelog check and both compose downloads concurrently and combines them.
+# As soon as one check reports a breaking change the verdict is decided, so the
+# still pending checks are cancelled. Returns (changelogBreakingChanges,
+# composeBreakingChanges, updatedImages) where a cancelled check is reported as None.
+def EvaluateBreakingChanges(app, baseVersion, newVersion, allowRules: list = ()):
+    templateUrl = app_metadata[app]['templateUrl']
+    url1 = templateUrl.replace("<VERSION>", baseVersion)
+    url2 = templateUrl.replace("<VERSION>", newVersion)
+    printAndLog(f"== Processing docker-compose.yml for {baseVersion} from: {url1}")
+    printAndLog(f"== Processing docker-compose.yml for {newVersion} from: {url2}")
+
+    changelogBreakingChanges, composeBreakingChanges, updatedImages = None, None, None
+    cancelEvent = threading.Event()
+    cancelToken = _cancelEvent.set(cancelEvent)
+    executor = ThreadPoolExecutor(max_workers=3)
+    try:
+        changelogFuture = submitInRun(executor, runInSpan, 'changelog', app_metadata[app]['changelogBreakingChanges'], baseVersion, newVersion)
+        composeFuture = submitInRun(executor, DownloadAndParseComposeFiles, [url1, url2], composeCompanionFiles(app))
+        pending = {changelogFuture, composeFuture}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if changelogFuture in done:
+                changelogBreakingChanges = changelogFuture.result()
+                if changelogBreakingChanges:
+                    break
+            if composeBreakingChanges is None and composeFuture.done():
+                composeData1, composeData2 = composeFuture.result()
+                composeBreakingChanges, updatedImages = CompareComposeVersions(app, baseVersion, composeData1, newVersion, composeData2, allowRules)
+                if composeBreakingChanges:
+                    break
+    finally:
+        with _finishLock:
+            cancelEvent.set()
+        _cancelEvent.reset(cancelToken)
+        # Cancelled checks stop at their next request; don't wait for them.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return changelogBreakingChanges, composeBreakingChanges, updatedImages
+
 ####################################################################################
 
-if __name__ == "__main__":
+# Shared verdict store: hosts that evaluate the same (app, base, new) upgrade read the
+# verdict recorded by the first one instead of repeating its GitHub requests. Whoever
+# evaluates first holds a claim (a lease, so a crashed host doesn't block the others),
+# the other hosts wait for its verdict. Verdicts expire, since breaking change
+# announcements can be added after a release. Backends implement get/claim/put/release.
+class VerdictStore(ABC):
+    pollInterval = 1.0
+
+    def __init__(self, ttlHours: float = 24, leaseSeconds: float = 600):
+        self.ttl = ttlHours * 3600
+        self.leaseSeconds = leaseSeconds
+        self.host = f"{socket.gethostname()}:{os.getpid()}"
+
+    @property
+    def owner(self) -> str:
+        # Per thread, batch entries of one process can evaluate the same upgrade.
+        return f"{self.host}:{threading.get_ident()}"
+
+    @staticmethod
+    def key(app: str, baseVersion: str, newVersion: str, allowRules: list = ()) -> tuple:
+        # Hosts with different allow rules can reach different compose verdicts.
+        rules = hashlib.sha256(json.dumps(sorted(allowRules)).encode()).hexdigest()[:16] if allowRules else ''
+        return (app, baseVersion, newVersion, rules)
+
+    @abstractmethod
+    def claim(self, key: tuple):
+        # Returns (verdict, claimed): the stored verdict if there is one, otherwise
+        # whether this host now holds the claim to evaluate it.
+        pass
+
+    @abstractmethod
+    def put(self, key: tuple, verdict: dict):
+        # Stores the verdict and releases the claim.
+        pass
+
+    @abstractmethod
+    def release(self, key: tuple):
+        pass
+
+    def acquire(self, key: tuple, timeout: float):
+        # Stored verdict, or None once this host holds the claim (or gave up waiting).
+        deadline = time.monotonic() + timeout
+        waiting = False
+        while True:
+            verdict, claimed = self.claim(key)
+            if verdict is not None or claimed:
+                return verdict
+            if time.monotonic() + self.pollInterval >= deadline:
+                printAndLog(f"== Timed out waiting for another host's verdict, evaluating here")
+                return None
+            if not waiting:
+                printAndLog(f"== Another host is evaluating this upgrade, waiting for its verdict ...")
+                waiting = True
+            time.sleep(self.pollInterval)
+
+class SqliteVerdictStore(VerdictStore):
+    # Uses a rollback journal rather than WAL, which isn't safe on network filesystems.
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = os.path.expanduser(path)
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS verdicts (app TEXT, base TEXT, new TEXT, rules TEXT, verdict TEXT, "
+                       "host TEXT, createdAt REAL, expiresAt REAL, PRIMARY KEY (app, base, new, rules))")
+            db.execute("CREATE TABLE IF NOT EXISTS claims (app TEXT, base TEXT, new TEXT, rules TEXT, owner TEXT, "
+                       "expiresAt REAL, PRIMARY KEY (app, base, new, rules))")
+
+    @contextlib.contextmanager
+    def connect(self):
+        import sqlite3
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            # Take the write lock up front so check-and-claim is atomic across hosts.
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _verdict(db, key: tuple):
+        row = db.execute("SELECT verdict, host, createdAt FROM verdicts WHERE app=? AND base=? AND new=? AND rules=? AND expiresAt>?",
+                         (*key, time.time())).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[0]), host=row[1], createdAt=row[2])
+
+    def claim(self, key: tuple):
+        now = time.time()
+        with self.connect() as db:
+            verdict = self._verdict(db, key)
+            if verdict is not None:
+                return verdict, False
+            row = db.execute("SELECT owner FROM claims WHERE app=? AND base=? AND new=? AND rules=? AND expiresAt>?",
+                             (*key, now)).fetchone()
+            if row is not None and row[0] != self.owner:
+                return None, False
+            db.execute("INSERT OR REPLACE INTO claims VALUES (?, ?, ?, ?, ?, ?)", (*key, self.owner, now + self.leaseSeconds))
+            return None, True
+
+    def put(self, key: tuple, verdict: dict):
+        now = time.time()
+        with self.connect() as db:
+            db.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (*key, json.dumps(verdict), self.host, now, now + self.ttl))
+            db.execute("DELETE FROM claims WHERE app=? AND base=? AND new=? AND rules=? AND owner=?", (*key, self.owner))
+
+    def release(self, key: tuple):
+        with self.connect() as db:
+            db.execute("DELETE FROM claims WHERE app=? AND base=? AND new=? AND rules=? AND owner=?", (*key, self.owner))
+
+verdictStoreBackends = {
+    'sqlite': SqliteVerdictStore,
+}
+
+def openVerdictStore(spec: str, **kwargs) -> VerdictStore:
+    # "sqlite:/shared/verdicts.db", a plain path means sqlite.
+    scheme, sep, location = spec.partition(':')
+    if not sep or scheme not in verdictStoreBackends:
+        scheme, location = 'sqlite', spec
+    return verdictStoreBackends[scheme](location, **kwargs)
+
+# Replaced in __main__ with --verdict-store.
+verdictStore = None
+
+def EvaluateBreakingChangesShared(app, baseVersion, newVersion, allowRules: list = ()):
+    # EvaluateBreakingChanges through the verdict store, if one is configured.
+    if verdictStore is None:
+        return EvaluateBreakingChanges(app, baseVersion, newVersion, allowRules)
+    key = verdictStore.key(app, baseVersion, newVersion, allowRules)
+    with span('verdictStore'):
+        verdict = verdictStore.acquire(key, min(verdictStore.leaseSeconds, httpClient.remaining()))
+    if verdict is not None:
+        createdAt = datetime.fromtimestamp(verdict['createdAt'], timezone.utc).isoformat(timespec='seconds')
+        printAndLog(f"== Using the verdict recorded by {verdict['host']} at {createdAt}")
+        recordCounter('verdictStoreHits')
+        return verdict['changelogBreakingChanges'], verdict['composeBreakingChanges'], verdict['updatedImages']
+    try:
+        changelogBreakingChanges, composeBreakingChanges, updatedImages = EvaluateBreakingChanges(app, baseVersion, newVersion, allowRules)
+    except BaseException:
+        verdictStore.release(key)
+        raise
+    if checkUnknown in (changelogBreakingChanges, composeBreakingChanges):
+        # Only definite verdicts are shared, the next run checks again.
+        verdictStore.release(key)
+        return changelogBreakingChanges, composeBreakingChanges, updatedImages
+    verdictStore.put(key, {'changelogBreakingChanges': changelogBreakingChanges,
+                           'composeBreakingChanges': composeBreakingChanges, 'updatedImages': updatedImages})
+    return changelogBreakingChanges, composeBreakingChanges, updatedImages
+
+####################################################################################
 
+def ListGitHubReleases(owner, repo, isOlderThanNeeded=None, maxPages: int = 10):
+    # Published (non draft, non prerelease) releases, newest first. Paging stops at the
+    # first page that reaches a release for which isOlderThanNeeded() is true.
+    recent = releaseCatalog.releases(owner, repo)
+    if recent and isOlderThanNeeded and any(isOlderThanNeeded(r) for r in recent):
+        return [r for r in recent if not r.get('draft') and not r.get('prerelease')]
+    releases = []
+    for page in range(1, maxPages + 1):
+        url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/releases?per_page=100&page={page}"
+        pageData = json.loads(httpCache.getRevalidated(url, headers=githubRestHeaders()))
+        releases += [r for r in pageData if not r.get('draft') and not r.get('prerelease')]
+        if len(pageData) < 100 or (isOlderThanNeeded and any(isOlderThanNeeded(r) for r in pageData)):
+            break
+    return releases
+
+# Compose fingerprints per (app, version), persisted next to the HTTP cache so later
+# runs compare known versions without downloading anything.
+class ComposeFingerprintStore:
+    # Bumped whenever the compose model changes; fingerprints of other formats are dropped.
+    formatVersion = 3
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    stored = json.load(f)
+                if stored.get('formatVersion') == self.formatVersion:
+                    self.fingerprints = stored.get('apps', {})
+            except (IOError, ValueError, AttributeError):
+                self.fingerprints = {}
+
+    def get(self, app: str, version: str):
+        with self.lock:
+            fingerprint = self.fingerprints.get(app, {}).get(version)
+            # Whole file hashes of older versions of this script don't count.
+            return fingerprint if isinstance(fingerprint, dict) else None
+
+    def put(self, app: str, version: str, fingerprint: dict):
+        with self.lock:
+            self.fingerprints.setdefault(app, {})[version] = fingerprint
+            if self.path:
+                tmpPath = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmpPath, 'w') as f:
+                    json.dump({'formatVersion': self.formatVersion, 'apps': self.fingerprints}, f, indent=1)
+                os.replace(tmpPath, self.path)
+
+_fingerprintStore = None
+_fingerprintStoreLock = threading.Lock()
+
+def GetComposeFingerprintStore() -> ComposeFingerprintStore:
+    global _fingerprintStore
+    with _fingerprintStoreLock:
+        if _fingerprintStore is None:
+            _fingerprintStore = ComposeFingerprintStore(os.path.join(httpCache.cacheDir, 'compose-fingerprints.json') if httpCache.cacheDir else None)
+        return _fingerprintStore
+
+# Finds the newest release between base and a blocked release that is still safe
+# relative to base (no changelog breaking change and an image-only compose change).
+# Assuming a change stays once introduced, safety is a prefix of the ordered
+# releases, so galloping then bisecting checks O(log n) releases instead of n.
+class UpgradePlanner:
+    def __init__(self, app: str, baseVersion: str, minHoursSinceRelease: int, allowRules: list = ()):
+        self.app = app
+        self.baseVersion = baseVersion
+        self.minHoursSinceRelease = minHoursSinceRelease
+        self.engine = ComposeDiffEngine(allowRules)
+        self.probes = 0
+        self.changelogIndex = None
+        self.changelogFetched = False
+
+    @staticmethod
+    def versionKey(version: str):
+        return parseVersionString(version.lstrip('v'))
+
+    def candidates(self, blockedVersion: str) -> list:
+        # Eligible releases in (base, blocked), oldest first.
+        meta = app_metadata[self.app]
+        baseKey = self.versionKey(self.baseVersion)
+        blockedKey = self.versionKey(blockedVersion)
+        def versionOf(release):
+            version = meta['tag2version'](release['tag_name'])
+            return version if meta['validateVersion'](version) else None
+        releases = ListGitHubReleases(meta['owner'], meta['repo'],
+                                      lambda r: versionOf(r) is not None and self.versionKey(versionOf(r)) <= baseKey)
+        now = datetime.now(timezone.utc)
+        candidates = {}
+        for release in releases:
+            version = versionOf(release)
+            if version is None or not (baseKey < self.versionKey(version) < blockedKey):
+                continue
+            if now - datetime.fromisoformat(release['published_at']) < timedelta(hours=self.minHoursSinceRelease):
+                continue
+            candidates[version] = self.versionKey(version)
+        return sorted(candidates, key=candidates.get)
+
+    def composeUnits(self, version: str) -> dict:
+        composeData = DownloadAndParseComposeFile(app_metadata[self.app]['templateUrl'].replace("<VERSION>", version),
+                                                  composeCompanionFiles(self.app))
+        RemoveImageTags(composeData)
+        return ComposeDiffEngine.canonicalUnits(composeData)
+
+    def fingerprint(self, version: str) -> dict:
+        store = GetComposeFingerprintStore()
+        fingerprint = store.get(self.app, version)
+        if fingerprint is None:
+            fingerprint = ComposeDiffEngine.fingerprint(self.composeUnits(version))
+            store.put(self.app, version, fingerprint)
+        return fingerprint
+
+    def composeSafe(self, version: str) -> bool:
+        fingerprint1, fingerprint2 = self.fingerprint(self.baseVersion), self.fingerprint(version)
+        if fingerprint1 == fingerprint2:
+            return True
+        if not self.engine.allowRules:
+            return False
+        # Only download both files when the differing services might all be allowed.
+        breakingChanges, _ = self.engine.compare(self.composeUnits(self.baseVersion), self.composeUnits(version),
+                                                 fingerprint1, fingerprint2)
+        return not breakingChanges
+
+    def changelogSafe(self, version: str) -> bool:
+        meta = app_metadata[self.app]
+        source = meta.get('changelogSource')
+        if source is None:
+            return not meta['changelogBreakingChanges'](self.baseVersion, version)
+        # Every probe is answered from one refresh of the index, like the backtest does.
+        if not self.changelogFetched:
+            self.changelogFetched = True
+            index = GetBreakingChangeIndex(source)
+            try:
+                index.refresh()
+            except requests.exceptions.RequestException as e:
+                printAndLog(f"== Planner: Error fetching changelog: {e}")
+                return False
+            baseVersion = self.versionKey(self.baseVersion)
+            if not index.covers(baseVersion):
+                printAndLog(f"== Planner: Changelog index doesn't reach back to base version {self.baseVersion}")
+                return False
+            self.changelogIndex = index
+        if self.changelogIndex is None:
+            return False
+        return not self.changelogIndex.breakingChanges(self.versionKey(self.baseVersion), self.versionKey(version))
+
+    def isSafe(self, version: str) -> bool:
+        self.probes += 1
+        with span('planProbe', version=version):
+            safe = self.changelogSafe(version) and self.composeSafe(version)
+        printAndLog(f"== Planner: {version} is {'safe' if safe else 'not safe'} relative to {self.baseVersion}")
+        return safe
+
+    def furthestSafe(self, candidates: list):
+        lo, hi = -1, len(candidates)
+        step = 1
+        while lo + step < hi:
+            if self.isSafe(candidates[lo + step]):
+                lo, step = lo + step, step * 2
+            else:
+                hi = lo + step
+                break
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.isSafe(candidates[mid]):
+                lo = mid
+            else:
+                hi = mid
+        return candidates[lo] if lo >= 0 else None
+
+def allowRulesFor(args) -> list:
+    return app_metadata[args.app].get('allowRules', []) + (getattr(args, 'allow_rule', None) or [])
+
+def planAndApplyIntermediate(args, envFileLines: List[str], blockedVersion: str):
+    # Returns only if no safe intermediate release was found.
+    app = args.app
+    planner = UpgradePlanner(app, args.base_version, args.min_hours_since_latest, allowRulesFor(args))
+    try:
+        with span('plan'):
+            candidates = planner.candidates(blockedVersion)
+            printAndLog(f"== Planner: {len(candidates)} eligible release(s) between {args.base_version} and {blockedVersion}")
+            target = planner.furthestSafe(candidates)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        printAndLog(f"== Planner: Failed to plan an intermediate upgrade: {e}")
+        return
+    if target is None:
+        printAndLog(f"== Planner: No safe intermediate release between {args.base_version} and {blockedVersion}.")
+        return
+
+    printAndLog(f"Furthest safe intermediate release of {app} is {target} ({planner.probes} checks for {len(candidates)} releases).")
+    if args.file:
+        composeData = DownloadAndParseComposeFile(app_metadata[app]['templateUrl'].replace("<VERSION>", target), composeCompanionFiles(app))
+        applyUpdate(args, envFileLines, target, RemoveImageTags(composeData))
+    notifyAndExit(f"✅{app} conservative update: Done with intermediate {target} ({blockedVersion} blocked)")
+
+####################################################################################
+
+def buildArgParser():
     parser = argparse.ArgumentParser(
         description="Compare Docker Compose files for two release versions.",
         formatter_class=argparse.RawTextHelpFormatter
@@ -419,15 +2697,231 @@ if __name__ == "__main__":
         "--gotify-token",
         help="Gotify Token to send notification"
     )
+    parser.add_argument('-b',
+        "--batch",
+        help="YAML manifest of apps (list of entries with the long option names as keys,\n"
+             "e.g. app, file, restart_systemd_unit) to evaluate concurrently in one process"
+    )
+    parser.add_argument('-j',
+        "--jobs",
+        default=4,
+        type=int,
+        help="Maximum number of apps evaluated at the same time in batch mode\n"
+             "(processes comparing compose files with --backtest)"
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=defaultCacheDir(),
+        help="Directory of the persistent HTTP cache (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        default=64,
+        type=int,
+        help="Size bound of the HTTP cache in MiB, least recently used entries are evicted first"
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the persistent HTTP cache"
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        default=5,
+        type=float,
+        help="Connect timeout in seconds for every HTTP request"
+    )
+    parser.add_argument(
+        "--read-timeout",
+        default=30,
+        type=float,
+        help="Read timeout in seconds for every HTTP request"
+    )
+    parser.add_argument(
+        "--retries",
+        default=3,
+        type=int,
+        help="Retries of transient HTTP failures (connection errors, 429, 5xx), with jittered exponential backoff"
+    )
+    parser.add_argument(
+        "--run-timeout",
+        default=600,
+        type=float,
+        help="Overall deadline in seconds for the network checks of a run, 0 for none.\n"
+             "Requests past the deadline fail and the run reports an error."
+    )
+    parser.add_argument(
+        "--github-token",
+        default=os.environ.get('GITHUB_TOKEN'),
+        help="GitHub token (default: $GITHUB_TOKEN). Optional, enables the GitHub GraphQL API and raises the REST API rate limit"
+    )
+    parser.add_argument(
+        "--multi-hop",
+        action="store_true",
+        help="If the new version is blocked, upgrade to the newest release in between that is\n"
+             "still safe (checks O(log n) releases)"
+    )
+    parser.add_argument(
+        "--pin-digests",
+        action="store_true",
+        help="Write image variables to the env file pinned to their registry digest (image:tag@sha256:...)"
+    )
+    parser.add_argument(
+        "--no-digest-check",
+        action="store_true",
+        help="Pull all images on restart instead of only those whose registry digest isn't present locally"
+    )
+    parser.add_argument(
+        "--verdict-store",
+        metavar="STORE",
+        help="Share verdicts with other hosts, e.g. 'sqlite:/shared/verdicts.db'. A host evaluating\n"
+             "the same upgrade reads the stored verdict instead of repeating the checks"
+    )
+    parser.add_argument(
+        "--verdict-ttl",
+        type=float,
+        default=24,
+        metavar="HOURS",
+        help="Hours a stored verdict is reused (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--system",
+        action="store_true",
+        help="Root containers: restart a system (instead of --user) systemd unit and use the rootful\n"
+             "Podman socket"
+    )
+    parser.add_argument(
+        "--no-engine-api",
+        action="store_true",
+        help="Use the docker/podman and systemctl CLIs instead of the engine API socket and D-Bus"
+    )
+    parser.add_argument(
+        "--health-timeout",
+        type=float,
+        default=300,
+        metavar="SECONDS",
+        help="After a restart, wait this long for all containers to run and be healthy and for the\n"
+             "--health-url probes to succeed, otherwise roll back (default: %(default)s, 0 disables)"
+    )
+    parser.add_argument(
+        "--health-url",
+        action="append",
+        metavar="URL",
+        help="HTTP endpoint that must answer without an error after a restart. Can be repeated"
+    )
+    parser.add_argument(
+        "--allow-rule",
+        action="append",
+        metavar="PATTERN",
+        help="Treat compose changes under this dotted path as benign, e.g.\n"
+             "'services.*.healthcheck' or 'services.redis.environment.TZ'. Can be repeated"
+    )
+    parser.add_argument(
+        "--backtest",
+        action="store_true",
+        help="Instead of updating, replay the policy over all historical release pairs of the app\n"
+             "and print the verdict matrix (uses -m, --allow-rule and -j processes)"
+    )
+    parser.add_argument(
+        "--backtest-window",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Only backtest pairs at most N releases apart (default: all pairs)"
+    )
+    parser.add_argument(
+        "--backtest-output",
+        metavar="FILE",
+        help="Write every backtested pair with its verdict and reasons as JSON lines"
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Stay resident and check the app (or all apps of --batch) on a schedule instead of once"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        default=6,
+        type=float,
+        help="Hours between checks of an app in daemon mode. A release blocked by\n"
+             "--min-hours-since-latest is re-checked as soon as it becomes eligible."
+    )
+    parser.add_argument(
+        "--status-port",
+        type=int,
+        help="Serve the daemon's schedule and last verdict per app as JSON on 127.0.0.1:PORT"
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        help="Append every run's log and stage timing events as JSON lines to this file"
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        help="Write the last run's stage timings and counters per app to this node_exporter\n"
+             "textfile (e.g. /var/lib/node_exporter/textfile_collector/conservative_update.prom)"
+    )
+    parser.add_argument(
+        "--check-startup",
+        nargs='?',
+        const=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json'),
+        metavar="BASELINE",
+        help="Check that a no-op run (same version on both sides) of the conservativeContainerUpdate\n"
+             "launcher, interpreter included, is at most 25%% slower than the startup benchmark\n"
+             "in BASELINE (default: benchmark_baseline.json next to this script) and that the\n"
+             "stage specific modules (bs4, yaml, packaging) are still lazily loaded"
+    )
+    return parser
 
-    args = parser.parse_args()
-
-    if args.gotify_url and args.gotify_token:
-        notifier = GotifyNotifier(args.gotify_url, args.gotify_token)
-        
-
+def applyUpdate(args, envFileLines: List[str], newVersion: str, updatedImages: dict):
+    # Writes newVersion and the new image tags to the env file and restarts the app.
+    app = args.app
+    printAndLog(f"Attempting to update {app} from {args.base_version} to {newVersion}.")
+    updatedVars = {}
+    updatedVars[app_metadata[app]['versionEnvVariable']] = newVersion
+    for k in updatedImages.keys():
+        # Skip all images where the value is already VERSION based.
+        if app_metadata[app]['versionEnvVariable'] in updatedImages[k]: 
+            continue
+        elif '$' in updatedImages[k]:
+            printAndLog(f"The image for {k} container in {app} contains a variable. Unexpected, treating as a breaking change.")
+            notifyAndExit(f"⚠️ {app} conservative update: breaking change")
+        else:
+            envVar = "{}_{}_IMAGE".format(app.upper(), k.upper())
+            updatedVars[envVar] = updatedImages[k]
+    images = list(resolveImageReferences(app, newVersion, updatedImages).values())
+    if args.pin_digests and registryClient:
+        # Only the *_IMAGE variables can carry a digest, the version variable is shared by several images.
+        digests = registryClient.resolveDigests([v for k, v in updatedVars.items() if k.endswith('_IMAGE') and '@' not in v])
+        for k, v in updatedVars.items():
+            if digests.get(v):
+                updatedVars[k] = f"{v}@{digests[v]}"
+                images = [updatedVars[k] if image == v else image for image in images]
+    if not args.dry_run:
+        updateEnvFile(args.file, envFileLines, updatedVars)
+        printAndLog(f"Environment file {args.file} updated with version {newVersion} and tags")
+        if not restartApp(args, images):
+            # The old containers are still running, put the env file back to match them.
+            restoreEnvFile(args.file, envFileLines)
+            printAndLog(f"== Not all images of {newVersion} could be pulled, {app} was left running {args.base_version}.")
+            notifyErrorAndExit(7)
+        if (args.restart_systemd_unit or args.restart_compose_file) and args.health_timeout > 0:
+            healthy, elapsed = verifyRestartedApp(args)
+            if healthy:
+                recordCounter('timeToHealthySeconds', elapsed)
+                printAndLog(f"== {app} {newVersion} is healthy after {elapsed:.1f}s")
+                return
+            printAndLog(f"== {app} {newVersion} did not become healthy, rolling back to {args.base_version} ...")
+            rollbackStart = time.monotonic()
+            with span('rollback'):
+                restoreEnvFile(args.file, envFileLines)
+                restartApp(args)
+                healthy, _ = verifyRestartedApp(args)
+            recordCounter('timeToRollbackSeconds', elapsed + time.monotonic() - rollbackStart)
+            printAndLog(f"== Rolled back to {args.base_version}, which is {'healthy' if healthy else 'NOT healthy either'}.")
+            finishRun(f"❌{app} conservative update: {newVersion} unhealthy, rolled back", 11)
+
+def runApp(args):
     app = args.app
-    templateUrl = app_metadata[app]['templateUrl']
 
     envFileLines=None
     if args.file:
@@ -440,13 +2934,18 @@ if __name__ == "__main__":
         owner = app_metadata[app]['owner']
         repo = app_metadata[app]['repo']
         print(f"Resolving 'latest' for {owner}/{repo} as new version ...")
-        resolvedVersion, resolvedTime = GetLatestGitHubReleaseTag(owner, repo)
+        with span('resolveVersion'):
+            resolvedVersion, resolvedTime = GetLatestGitHubReleaseTag(owner, repo)
         resolvedTimeAgo = datetime.now(timezone.utc) - datetime.fromisoformat(resolvedTime)
         if not resolvedVersion or not resolvedTime:
             printAndLog(f"Couldn't resolve latest version or it's release time.")
             notifyErrorAndExit(1) # Exit if 'latest' couldn't be resolved
         elif resolvedTimeAgo < timedelta(hours=args.min_hours_since_latest):
             printAndLog(f"Resolved 'latest' for {owner}/{repo} as {args.new_version} released at {resolvedTime} i.e. {resolvedTimeAgo} ago, less than {args.min_hours_since_latest} hrs. Exiting")
+            currentRun().nextCheckAt = datetime.fromisoformat(resolvedTime) + timedelta(hours=args.min_hours_since_latest)
+            blockedVersion = app_metadata[app]['tag2version'](resolvedVersion)
+            if args.multi_hop and args.base_version and app_metadata[app]['validateVersion'](blockedVersion):
+                planAndApplyIntermediate(args, envFileLines, blockedVersion)
             notifyAndExit(f"ⓘ {app} conservative update: latest version is too now.")
         args.new_version = app_metadata[app]['tag2version'](resolvedVersion)
         print(f"Resolved 'latest' for {owner}/{repo} as {args.new_version} released {resolvedTimeAgo} ago...")
@@ -461,43 +2960,518 @@ if __name__ == "__main__":
 
     printAndLog(f"Comparing {app} versions: {args.base_version} vs {args.new_version}")
 
-    changelogBreakingChanges = immich_changelogBreakingChanges(args.base_version, args.new_version)
-    if changelogBreakingChanges:
+    changelogBreakingChanges, composeBreakingChanges, updatedImages = EvaluateBreakingChangesShared(app, args.base_version, args.new_version, allowRulesFor(args))
+    if changelogBreakingChanges == checkUnknown:
+        printAndLog(f"Changelog check for between {app} versions: {args.base_version} vs {args.new_version} was inconclusive. Stop")
+    elif changelogBreakingChanges:
         printAndLog(f"Detected breaking changes in changelog for between {app} versions: {args.base_version} vs {args.new_version}. Stop")
+    elif changelogBreakingChanges is None:
+        printAndLog(f"Skipped changelog check for between {app} versions: {args.base_version} vs {args.new_version}, verdict already decided.")
     else:
         printAndLog(f"No breaking changes detected in changelog for between {app} versions: {args.base_version} vs {args.new_version}.")
-        
-    composeBreakingChanges, updatedImages = CompareDockerCompose(templateUrl, args.base_version, args.new_version)
+
     if composeBreakingChanges:
         printAndLog(f"Detected breaking changes in compose file for between {app} versions: {args.base_version} vs {args.new_version}. Stop")
+    elif composeBreakingChanges is None:
+        printAndLog(f"Skipped compose file comparison for between {app} versions: {args.base_version} vs {args.new_version}, verdict already decided.")
     else:
         printAndLog(f"No breaking changes detected in compose file for between {app} versions: {args.base_version} vs {args.new_version}.")
 
     if changelogBreakingChanges or composeBreakingChanges: 
+        if args.multi_hop:
+            planAndApplyIntermediate(args, envFileLines, args.new_version)
         notifyAndExit(f"⚠️ {app} conservative update: breaking change")
     elif args.file:
-        printAndLog(f"Attempting to update {app} from {args.base_version} to {args.new_version}.")
-        updatedVars = {}
-        updatedVars[app_metadata[app]['versionEnvVariable']] = args.new_version
-        for k in updatedImages.keys():
-            # Skip all images where the value is already VERSION based.
-            if app_metadata[app]['versionEnvVariable'] in updatedImages[k]: 
-                continue
-            elif '$' in updatedImages[k]:
-                printAndLog(f"The image for {k} container in {app} contains a variable. Unexpected, treating as a breaking change.")
-                notifyAndExit(f"⚠️ {app} conservative update: breaking change")
-            else:
-                envVar = "{}_{}_IMAGE".format(app.upper(), k.upper())
-                updatedVars[envVar] = updatedImages[k]
-        if not args.dry_run:
-            updateEnvFile(args.file, envFileLines, updatedVars)
-            printAndLog(f"Environment file {args.file} updated with version {args.new_version} and tags")
-            if args.restart_systemd_unit:
-                restartSystemdUnit(args.restart_systemd_unit)
-            elif args.restart_compose_file:
-                restartDockerCompose(args.restart_compose_file)
+        applyUpdate(args, envFileLines, args.new_version, updatedImages)
         notifyAndExit(f"✅{app} conservative update: Done")
     else:
         printAndLog(f"No breaking changes found. Nothing to do.")
         notifyAndExit(f"✅{app} conservative update: Done")
 
+
+####################################################################################
+
+# Backtest: what would the current policy (min hours, allow rules, changelog hook)
+# have decided for every historical (base, new) pair of an app? The release history
+# is listed once, every compose file is downloaded and canonicalized once, and pairs
+# with equal fingerprints are decided without a diff; the remaining pairs are deep
+# diffed on a process pool.
+_backtestState = None
+
+def _backtestInit(units: dict, fingerprints: dict, allowRules: list):
+    global _backtestState
+    _backtestState = (units, fingerprints, ComposeDiffEngine(allowRules))
+
+def _backtestComparePairs(pairs: list) -> list:
+    units, fingerprints, engine = _backtestState
+    results = []
+    for base, new in pairs:
+        breakingChanges, benignChanges = engine.compare(units[base], units[new], fingerprints[base], fingerprints[new])
+        results.append((base, new, [f"{path}: {formatComposeValue(old)} -> {formatComposeValue(n)}" for path, old, n in breakingChanges],
+                        len(benignChanges)))
+    return results
+
+def loadBacktestHistory(app: str) -> list:
+    # (version, published_at) of all releases, oldest first.
+    meta = app_metadata[app]
+    history = {}
+    for release in ListGitHubReleases(meta['owner'], meta['repo'], maxPages=50):
+        version = meta['tag2version'](release['tag_name'])
+        if meta['validateVersion'](version) and release.get('published_at'):
+            history[version] = release['published_at']
+    return sorted(history.items(), key=lambda item: parseVersionString(item[0].lstrip('v')))
+
+def backtestChangelogVerdicts(app: str, pairs: list) -> dict:
+    # (base, new) -> list of breaking change titles, or None if unknown.
+    meta = app_metadata[app]
+    source = meta.get('changelogSource')
+    verdicts = {}
+    if source is not None:
+        # Answer all pairs from one refresh of the index instead of one per pair.
+        index = GetBreakingChangeIndex(source)
+        try:
+            index.refresh()
+        except requests.exceptions.RequestException as e:
+            print(f"== Error fetching changelog: {e}")
+            return {pair: None for pair in pairs}
+        for base, new in pairs:
+            baseVersion = parseVersionString(base.lstrip('v'))
+            covered = index.covers(baseVersion)
+            verdicts[(base, new)] = [e['title'] for e in index.breakingChanges(baseVersion, parseVersionString(new.lstrip('v')))] if covered else None
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for base, new in pairs:
+                verdicts[(base, new)] = ['changelog hook'] if meta['changelogBreakingChanges'](base, new) else []
+    return verdicts
+
+def runBacktest(args) -> int:
+    from concurrent.futures import ProcessPoolExecutor
+    app = args.app
+    started = time.perf_counter()
+    history = loadBacktestHistory(app)
+    versions = [version for version, _ in history]
+    publishedAt = {version: datetime.fromisoformat(published) for version, published in history}
+    print(f"== Backtesting {app}: {len(versions)} releases from {versions[0] if versions else '-'} to {versions[-1] if versions else '-'}")
+    myassert(len(versions) >= 2, f"Need at least two releases of {app} to backtest")
+    historyTime = time.perf_counter() - started
+
+    # Each compose file is downloaded (or read from the cache) and canonicalized once.
+    started = time.perf_counter()
+    import yaml
+    templateUrl = app_metadata[app]['templateUrl']
+    def load(version):
+        try:
+            composeData = loadComposeModel(templateUrl.replace("<VERSION>", version), composeCompanionFiles(app))
+        except (requests.exceptions.RequestException, ValueError, yaml.YAMLError) as e:
+            print(f"== No usable compose file for {version}: {e}")
+            return None
+        RemoveImageTags(composeData)
+        return ComposeDiffEngine.canonicalUnits(composeData)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        units = dict(zip(versions, executor.map(lambda v: contextvars.copy_context().run(load, v), versions)))
+    units = {version: u for version, u in units.items() if u is not None}
+    fingerprints = {version: ComposeDiffEngine.fingerprint(u) for version, u in units.items()}
+    parseTime = time.perf_counter() - started
+
+    window = args.backtest_window or len(versions)
+    pairs = [(versions[i], versions[j]) for i in range(len(versions)) for j in range(i + 1, min(len(versions), i + window + 1))]
+
+    started = time.perf_counter()
+    changelog = backtestChangelogVerdicts(app, pairs)
+    changelogTime = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compose = {}
+    toDiff = []
+    for base, new in pairs:
+        if base not in units or new not in units:
+            compose[(base, new)] = None
+        elif fingerprints[base] == fingerprints[new]:
+            compose[(base, new)] = ([], 0)
+        else:
+            toDiff.append((base, new))
+    jobs = max(1, args.jobs)
+    chunks = [toDiff[i:i + 200] for i in range(0, len(toDiff), 200)]
+    if chunks:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(chunks)), initializer=_backtestInit,
+                                 initargs=(units, fingerprints, allowRulesFor(args))) as executor:
+            for results in executor.map(_backtestComparePairs, chunks):
+                for base, new, breakingChanges, benignCount in results:
+                    compose[(base, new)] = (breakingChanges, benignCount)
+    compareTime = time.perf_counter() - started
+
+    now = datetime.now(timezone.utc)
+    minAge = timedelta(hours=args.min_hours_since_latest)
+    rows = []
+    for base, new in pairs:
+        reasons = []
+        titles = changelog[(base, new)]
+        if titles is None:
+            reasons.append("changelog unknown")
+        elif titles:
+            reasons.append(f"changelog: {'; '.join(titles)}")
+        if compose[(base, new)] is None:
+            reasons.append("compose file missing")
+        elif compose[(base, new)][0]:
+            reasons.append(f"compose: {len(compose[(base, new)][0])} change(s)")
+        if now - publishedAt[new] < minAge:
+            reasons.append("too new")
+        rows.append({'base': base, 'new': new, 'verdict': 'blocked' if reasons else 'update', 'reasons': reasons,
+                     'composeChanges': compose[(base, new)][0] if compose[(base, new)] else None,
+                     'allowedChanges': compose[(base, new)][1] if compose[(base, new)] else None})
+
+    # Releases replaced by a newer one within the min age were never eligible as 'latest'.
+    superseded = [versions[i] for i in range(len(versions) - 1)
+                  if publishedAt[versions[i + 1]] - publishedAt[versions[i]] < minAge]
+
+    if args.backtest_output:
+        with open(args.backtest_output, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row) + "\n")
+        print(f"== Wrote {len(rows)} verdicts to {args.backtest_output}")
+    printBacktestMatrix(versions, rows, window)
+
+    total = historyTime + parseTime + changelogTime + compareTime
+    blocked = sum(1 for row in rows if row['verdict'] == 'blocked')
+    print(f"== {len(pairs)} pairs: {len(pairs) - blocked} update, {blocked} blocked; "
+          f"{len(toDiff)} needed a diff, {len(pairs) - len(toDiff)} decided by fingerprint")
+    print(f"== {len(superseded)} release(s) were superseded within {args.min_hours_since_latest} hrs and never eligible as latest")
+    print(f"== Time: history {historyTime:.2f}s, {len(units)} compose files {parseTime:.2f}s, changelog {changelogTime:.2f}s, "
+          f"diffs {compareTime:.2f}s with {jobs} process(es); {len(pairs) / max(changelogTime + compareTime, 1e-9):.0f} pairs/s, "
+          f"{total:.2f}s total")
+    return 0
+
+def printBacktestMatrix(versions: list, rows: list, window: int):
+    # Rows are base versions, columns new versions: '.' update, 'L' changelog,
+    # 'C' compose, 'B' both, 'T' too new only, '?' unknown.
+    if len(versions) > 80:
+        print(f"== {len(versions)} releases are too many for a matrix, see --backtest-output")
+        return
+    cells = {}
+    for row in rows:
+        reasons = row['reasons']
+        changelog = any(r.startswith('changelog:') for r in reasons)
+        compose = any(r.startswith('compose:') for r in reasons)
+        if any(r.endswith('unknown') or r.endswith('missing') for r in reasons):
+            cell = '?'
+        elif changelog or compose:
+            cell = 'B' if changelog and compose else 'L' if changelog else 'C'
+        else:
+            cell = 'T' if reasons else '.'
+        cells[(row['base'], row['new'])] = cell
+    width = max(len(v) for v in versions)
+    print("== Verdicts (rows: base, columns: new; . update, L changelog, C compose, B both, T too new, ? unknown)")
+    for i, base in enumerate(versions[:-1]):
+        print(f"{base:>{width}} " + "".join(cells.get((base, new), ' ') for new in versions[1:]))
+
+####################################################################################
+
+# Daemon mode: stays resident so the HTTP session, cache and changelog indexes stay
+# warm, and schedules every app individually. A release blocked only by
+# --min-hours-since-latest is re-checked right when it becomes eligible, other apps
+# every --poll-interval hours. Failed checks are retried with exponential backoff, and
+# polling is stretched (or paused until the reset) when the GitHub rate limit runs low.
+class DaemonScheduler:
+    eligibleSlack = timedelta(minutes=1)
+    retryBase = timedelta(minutes=5)
+    rateLimitReserve = 5
+
+    def __init__(self, entries: list, pollInterval: timedelta, jobs: int):
+        self.pollInterval = pollInterval
+        self.jobs = jobs
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+        now = datetime.now(timezone.utc)
+        self.apps = [{
+            'args': entryArgs,
+            'nextCheck': now,
+            'lastCheck': None,
+            'lastTitle': None,
+            'lastExitCode': None,
+            'failures': 0,
+            'running': False,
+        } for entryArgs in entries]
+
+    def _pollInterval(self) -> timedelta:
+        rateLimit = httpClient.rateLimit
+        if rateLimit and rateLimit['limit'] and rateLimit['remaining'] < rateLimit['limit'] / 4:
+            # Spend the last quarter of the rate limit budget increasingly slowly.
+            return self.pollInterval * min(8, (rateLimit['limit'] / 4) / max(rateLimit['remaining'], 1))
+        return self.pollInterval
+
+    def _nextCheck(self, state: dict, run: AppRun, now: datetime) -> datetime:
+        if run.exitCode not in (0, None):
+            nextCheck = now + min(self.pollInterval, self.retryBase * (2 ** (state['failures'] - 1)))
+        else:
+            nextCheck = now + self._pollInterval()
+            if run.nextCheckAt is not None:
+                nextCheck = min(nextCheck, max(now, run.nextCheckAt) + self.eligibleSlack)
+        rateLimit = httpClient.rateLimit
+        if rateLimit and rateLimit['remaining'] <= self.rateLimitReserve:
+            nextCheck = max(nextCheck, datetime.fromtimestamp(rateLimit['reset'], timezone.utc) + self.eligibleSlack)
+        return nextCheck
+
+    def _check(self, state: dict):
+        entryArgs = argparse.Namespace(**vars(state['args']))
+        run = runAppIsolated(entryArgs, previousTitle=state['lastTitle'], runTimeout=httpClient.runTimeout)
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            state['failures'] = state['failures'] + 1 if run.exitCode not in (0, None) else 0
+            state['lastCheck'] = now
+            state['lastTitle'] = run.title
+            state['lastExitCode'] = run.exitCode
+            state['nextCheck'] = self._nextCheck(state, run, now)
+            state['running'] = False
+            idle = not any(s['running'] for s in self.apps)
+        print(f"== [{run.app}] Next check at {state['nextCheck'].isoformat(timespec='seconds')}")
+        if idle:
+            # Checks that were due together are notified as one digest.
+            flushNotifications()
+
+    def status(self) -> dict:
+        def isoOrNone(t):
+            return t.isoformat(timespec='seconds') if t else None
+        with self.lock:
+            return {
+                'apps': [{
+                    'app': state['args'].app,
+                    'file': state['args'].file,
+                    'running': state['running'],
+                    'nextCheck': isoOrNone(state['nextCheck']),
+                    'lastCheck': isoOrNone(state['lastCheck']),
+                    'lastVerdict': state['lastTitle'],
+                    'lastExitCode': state['lastExitCode'],
+                } for state in self.apps],
+                'rateLimit': httpClient.rateLimit,
+            }
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while not self.stopEvent.is_set():
+                now = datetime.now(timezone.utc)
+                with self.lock:
+                    due = [state for state in self.apps if not state['running'] and state['nextCheck'] <= now]
+                    for state in due:
+                        state['running'] = True
+                    idle = [state['nextCheck'] for state in self.apps if not state['running']]
+                for state in due:
+                    executor.submit(self._check, state)
+                # Wake up for the next due check; finished checks reschedule themselves.
+                sleepFor = (min(idle) - now).total_seconds() if idle else 60
+                self.stopEvent.wait(min(max(sleepFor, 1), 60))
+        print("== Daemon stopped.")
+
+class DaemonStatusHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.scheduler.status(), indent=2).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def runDaemon(args) -> int:
+    entries = loadBatchManifest(args.batch, args) if args.batch else [args]
+    scheduler = DaemonScheduler(entries, timedelta(hours=args.poll_interval), max(1, min(args.jobs, len(entries))))
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stopEvent.set())
+
+    if args.status_port:
+        statusServer = http.server.ThreadingHTTPServer(('127.0.0.1', args.status_port), DaemonStatusHandler)
+        statusServer.scheduler = scheduler
+        threading.Thread(target=statusServer.serve_forever, daemon=True).start()
+        print(f"== Status available at http://127.0.0.1:{statusServer.server_port}/")
+
+    print(f"Running as daemon for {len(entries)} app(s), polling every {args.poll_interval} hrs ...")
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stopEvent.set()
+    return 0
+
+####################################################################################
+
+# Startup regression check: times a no-op invocation ('--help') of the launcher the
+# systemd units run, in fresh interpreters, and fails if the best of a few runs exceeds
+# the budget or if any of the lazily imported modules got imported at load time again.
+# Running this file directly recompiles it every time; that is shown for comparison.
+def noOpCommand(launcher: str, cacheDir: str) -> list:
+    # A run that ends with "no update" without touching the network: the same version on both sides.
+    return [sys.executable, launcher, '-a', 'immich', '--base-version', 'v1.120.0', '--new-version', 'v1.120.0', '--cache-dir', cacheDir]
+
+def CheckStartupTime(baselinePath: str, tolerance: float = 0.25, runs: int = 5) -> int:
+    scriptDir = os.path.dirname(os.path.abspath(__file__))
+    moduleName = os.path.splitext(os.path.basename(__file__))[0]
+    launcher = os.path.join(scriptDir, moduleName)
+    try:
+        with open(baselinePath, 'r') as f:
+            baselineMs = min(result['p50_ms'] for name, result in json.load(f)['results'].items() if name.startswith('startup['))
+    except (IOError, ValueError, KeyError) as e:
+        print(f"== ERROR: No startup baseline in '{baselinePath}' ({e!r}), record one with 'benchmark.py --save-baseline'")
+        return 1
+    def medianOf(command: list) -> float:
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = subprocess.run(command, cwd=scriptDir, capture_output=True, text=True)
+            samples.append((time.perf_counter() - start) * 1000)
+            if result.returncode != 0:
+                raise EngineError(result.stderr.strip()[-2000:])
+        return sorted(samples)[len(samples) // 2]
+
+    import tempfile
+    with tempfile.TemporaryDirectory() as cacheDir:
+        try:
+            # Also brings the cached bytecode up to date before timing.
+            result = subprocess.run([sys.executable, '-X', 'importtime'] + noOpCommand(launcher, cacheDir)[1:], cwd=scriptDir, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise EngineError(result.stderr.strip()[-2000:])
+            totalMs = medianOf(noOpCommand(launcher, cacheDir))
+            scriptMs = medianOf(noOpCommand(os.path.join(scriptDir, moduleName + '.py'), cacheDir))
+        except EngineError as e:
+            print(f"== ERROR: Running {launcher} failed:\n{e}")
+            return 1
+    imported = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'^import time:\s+\d+\s+\|\s+(\d+)\s+\|( +)(\S+)$', line)
+        if match:
+            imported[match.group(3)] = (int(match.group(1)) / 1000, (len(match.group(2)) - 1) // 2)
+
+    budgetMs = baselineMs * (1 + tolerance)
+    print(f"== Startup: a no-op run of '{moduleName}' takes {totalMs:.1f} ms (median of {runs}), "
+          f"baseline {baselineMs:.1f} ms, budget {budgetMs:.1f} ms (+{tolerance:.0%})")
+    print(f"== Running {moduleName}.py directly (recompiled every run) takes {scriptMs:.1f} ms")
+    print("== Slowest imports at load time:")
+    children = [(ms, name) for name, (ms, depth) in imported.items() if depth == 0]
+    for ms, name in sorted(children, reverse=True)[:10]:
+        print(f"==   {ms:8.1f} ms  {name}")
+
+    eagerModules = sorted(name for name in imported if name.split('.')[0] in lazyModules)
+    if eagerModules:
+        print(f"== FAIL: Lazily loaded modules imported at startup: {', '.join(eagerModules)}")
+        return 1
+    if totalMs > budgetMs:
+        print(f"== FAIL: Startup is {totalMs / baselineMs - 1:.0%} slower than the baseline")
+        return 1
+    print("== Startup within budget.")
+    return 0
+
+####################################################################################
+
+# Keys a batch manifest entry may set; they mirror the long command line options.
+batchEntryKeys = ['app', 'file', 'base_version', 'new_version', 'min_hours_since_latest', 'dry_run', 'multi_hop',
+                  'allow_rule', 'pin_digests', 'health_timeout', 'health_url', 'system', 'restart_systemd_unit', 'restart_compose_file']
+
+def runAppIsolated(args, previousTitle: str = None, runTimeout: float = None) -> AppRun:
+    # Evaluates one app in its own AppRun. Exits and unexpected errors are captured
+    # as that app's verdict instead of ending the whole process.
+    run = AppRun(args.app, notifier, logPrefix=f"[{args.app}] ", previousTitle=previousTitle)
+    def evaluate():
+        _currentRun.set(run)
+        if runTimeout:
+            _runDeadline.set(time.monotonic() + runTimeout)
+        try:
+            runApp(args)
+        except SystemExit:
+            pass
+        except Exception as e:
+            printAndLog(f"== ERROR: Unexpected failure while evaluating {args.app}: {e!r}")
+            try:
+                notifyErrorAndExit(9)
+            except SystemExit:
+                pass
+    contextvars.copy_context().run(evaluate)
+    exportRunMetrics(run)
+    return run
+
+def loadBatchManifest(manifestPath: str, defaults) -> list:
+    import yaml
+    try:
+        with open(manifestPath, 'r') as f:
+            manifest = yaml.safe_load(f)
+    except (IOError, yaml.YAMLError) as e:
+        printAndLog(f"== ERROR: Failed to read batch manifest '{manifestPath}': {e}")
+        notifyErrorAndExit(5)
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get('apps')
+    myassert(isinstance(manifest, list) and len(manifest) > 0, f"Batch manifest '{manifestPath}' must contain a non-empty list of apps")
+
+    entries = []
+    for i, entry in enumerate(manifest):
+        myassert(isinstance(entry, dict), f"Batch manifest entry #{i} is not a mapping")
+        unknownKeys = set(entry.keys()) - set(batchEntryKeys)
+        myassert(not unknownKeys, f"Batch manifest entry #{i} has unknown keys: {sorted(unknownKeys)}")
+        myassert(entry.get('app') in app_metadata, f"Batch manifest entry #{i} has unknown app: {entry.get('app')}")
+        entryArgs = argparse.Namespace(**vars(defaults))
+        for k, v in entry.items():
+            if isinstance(v, str) and k in ('file', 'restart_compose_file'):
+                v = os.path.expanduser(v)
+            if k == 'allow_rule':
+                v = (defaults.allow_rule or []) + ([v] if isinstance(v, str) else list(v or []))
+            setattr(entryArgs, k, v)
+        entries.append(entryArgs)
+    return entries
+
+def runBatch(args) -> int:
+    entries = loadBatchManifest(args.batch, args)
+    jobs = max(1, min(args.jobs, len(entries)))
+    print(f"Evaluating {len(entries)} app(s) from {args.batch} with {jobs} worker(s) ...")
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        runs = list(executor.map(runAppIsolated, entries))
+    flushNotifications()
+
+    print("== Batch summary:")
+    for entryArgs, run in zip(entries, runs):
+        print(f"==   {run.app} ({entryArgs.file or entryArgs.base_version}): exit {run.exitCode} - {run.title}")
+    return max((run.exitCode or 0) for run in runs)
+
+if __name__ == "__main__":
+
+    parser = buildArgParser()
+    args = parser.parse_args()
+
+    if args.check_startup is not None:
+        sys.exit(CheckStartupTime(args.check_startup))
+
+    if args.gotify_url and args.gotify_token:
+        notifier = NotificationQueue(GotifyNotifier(args.gotify_url, args.gotify_token),
+                                     os.path.join(args.cache_dir, 'notification-queue.json'), digest=bool(args.batch or args.daemon))
+
+    githubToken = args.github_token
+    if args.metrics_jsonl or args.metrics_textfile:
+        metricsExporter = MetricsExporter(args.metrics_jsonl, args.metrics_textfile)
+    httpClient = HttpClient(args.connect_timeout, args.read_timeout, args.retries, runTimeout=args.run_timeout)
+    if not args.no_cache:
+        httpCache = HttpCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    if args.no_digest_check:
+        registryClient = None
+    useEngineApi = not args.no_engine_api
+    if args.verdict_store:
+        verdictStore = openVerdictStore(args.verdict_store, ttlHours=args.verdict_ttl, leaseSeconds=args.run_timeout or 600)
+
+    if args.app is None and not args.batch:
+        parser.error("the following arguments are required: -a/--app (or -b/--batch)")
+
+    try:
+        if args.backtest:
+            sys.exit(runBacktest(args))
+        if args.daemon:
+            sys.exit(runDaemon(args))
+        if args.batch:
+            sys.exit(runBatch(args))
+        run = AppRun(args.app, notifier)
+        _currentRun.set(run)
+        try:
+            runApp(args)
+        finally:
+            exportRunMetrics(run)
+    finally:
+        if notifier is not None:
+            notifier.close()
+        httpCache.save()
+        print(f"== {httpCache.summary()}")